@@ -27,8 +27,981 @@
 
 import os
 import sys
+import time
+import mmap
+import struct
+import heapq
+import hashlib
+import gzip
+import bz2
+import lzma
+import sqlite3
 import logging
-from collections import OrderedDict
+import json
+import locale
+import operator
+import tempfile
+import threading
+import cProfile
+import tracemalloc
+import multiprocessing
+from array import array
+from bisect import bisect_right
+from collections import Counter, OrderedDict
+from collections.abc import Mapping
+from contextlib import contextmanager, nullcontext
+from itertools import accumulate, chain, compress, islice, repeat
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+try:
+    import resource
+except ImportError:     # not available on Windows
+    resource = None
+
+_IS_SET = b"\x00" + b"\x01" * 255   # bytes.translate() table, nonzero -> 1
+
+# 20261018: binary pedigree cache, see PedRefiner.save_cache()
+CACHE_MAGIC = b"PEDRC001"
+CACHE_HEADER = struct.Struct("<8sQQQ64s")   # magic, n_code, n_rec, blob size, key
+
+
+# 20261018: compressed files and stdin/stdout
+_openers = {'.gz': gzip.open, '.bz2': bz2.open, '.xz': lzma.open}
+
+
+def open_file(file_name, mode='r'):
+    """
+    Open a text file, to be used in a with statement. '-' is stdin or stdout, files ending with .gz, .bz2 or
+    .xz are decompressed or compressed on the fly.
+    :param file_name: file name, or '-'
+    :param mode: 'r' or 'w'
+    :return: file object
+    """
+    if file_name == '-':
+        return nullcontext(sys.stdin if mode == 'r' else sys.stdout)
+    opener = _openers.get(os.path.splitext(file_name)[1].lower())
+    if opener is not None:
+        return opener(file_name, mode + 't')
+    return open(file_name, mode)
+
+
+def file_exists(file_name):
+    return file_name == '-' or os.path.exists(file_name)
+
+
+def is_plain_file(file_name):
+    """
+    :return: bool, True if file_name is neither '-' nor compressed, i.e. can be read by byte ranges
+    """
+    return file_name != '-' and os.path.splitext(file_name)[1].lower() not in _openers
+
+
+def save_npy(file_name, arr, shape):
+    """
+    Write an int32 or float64 array as a .npy file (format 1.0), readable by numpy.load(), without numpy
+    :param file_name: output file name
+    :param arr: array('i') or array('d'), in C order
+    :param shape: tuple of ints
+    """
+    header = "{{'descr': '{}', 'fortran_order': False, 'shape': {}, }}".format({'i': '<i4', 'd': '<f8'}[arr.typecode],
+                                                                              tuple(shape))
+    header += " " * (-(len(header) + 11) % 64) + "\n"     # magic, version and length take 10 bytes
+    if sys.byteorder == 'big':
+        arr = array(arr.typecode, arr)
+        arr.byteswap()
+    with open(file_name, 'wb') as fp:
+        fp.write(b"\x93NUMPY\x01\x00" + struct.pack("<H", len(header)) + header.encode('latin1'))
+        fp.write(arr)
+
+
+def _disk_array(dir_name, typecode, n):
+    """
+    n zeros in a memory-mapped temporary file of dir_name, indexed and sliced as an array; the pages are
+    written back to the file instead of taking memory. The file is gone once the array is.
+    :param typecode: 'i' or 'B'
+    :return: memoryview
+    """
+    size = array(typecode).itemsize * n
+    with tempfile.TemporaryFile(dir=dir_name, prefix="pedRefiner.") as fp:
+        fp.truncate(size + 1)       # mmap refuses an empty file
+        mm = mmap.mmap(fp.fileno(), size + 1)
+    return memoryview(mm)[:size].cast(typecode)
+
+
+# 20261018: in-memory footprint of load_ped(), check() and a large refine, per input line and per byte of it;
+#           about 200 + 250 B per line measured on 1M lines, most of it dict entries and str objects
+MEM_PER_LINE = 400
+MEM_PER_BYTE = 2
+
+
+def estimate_mem_mb(file_name):
+    """
+    Rough memory needed to load, check and refine a pedigree in memory, from the size of the file and the
+    length of its first lines. Compressed files are taken as 1/5 of their text.
+    :return: MB, or None if unknown
+    """
+    if file_name == '-' or not os.path.exists(file_name):
+        return None
+    size = os.path.getsize(file_name)
+    if not is_plain_file(file_name):
+        size *= 5
+    with open_file(file_name, 'r') as fp:
+        head = fp.read(1 << 20)
+    n_lines = size * max(head.count("\n"), 1) / max(len(head), 1)
+    return (n_lines * MEM_PER_LINE + size * MEM_PER_BYTE) / 1048576
+
+
+def get_sources(ped_fn, sep=',', missing_in='.'):
+    """
+    Input pedigrees of load_ped(): a file name; '@' followed by a sources manifest, one source per line,
+    whitespace delimited "FILE [SEP [MISSING_IN [PRIORITY]]]", \\t for a tab, lines starting with sharp ignored;
+    or a list of (FILE[, SEP[, MISSING_IN[, PRIORITY]]]) tuples. SEP and MISSING_IN default to sep and
+    missing_in, PRIORITY to 0
+    :return: list of (file name, sep, missing_in, priority) in loading order: by priority, then as listed, so
+             that a record replaces the one of the same ID from a source of lower or equal priority listed before
+    :raise ValueError: malformed manifest line
+    """
+    if isinstance(ped_fn, str) and not ped_fn.startswith('@'):
+        return [(ped_fn, sep, missing_in, 0)]
+    rows = ped_fn
+    if isinstance(ped_fn, str):
+        rows = []
+        if file_exists(ped_fn[1:]):
+            with open_file(ped_fn[1:], 'r') as fp:
+                for line in fp:
+                    vec_tmp = line.split()
+                    if not vec_tmp or vec_tmp[0][0] == "#":  # ignore empty or comment lines
+                        continue
+                    if len(vec_tmp) > 4:
+                        raise ValueError("sources manifest {}: 1 to 4 fields expected, line [{}]"
+                                         .format(ped_fn[1:], line.rstrip("\n")))
+                    rows.append([x.replace("\\t", "\t") for x in vec_tmp])
+    sources = []
+    for row in rows:
+        if isinstance(row, str):
+            row = (row,)
+        row = tuple(row) + (sep, missing_in, 0)[len(row) - 1:]
+        try:
+            sources.append((row[0], row[1], row[2], int(row[3])))
+        except ValueError:
+            raise ValueError("source {}: priority {} is not an integer".format(row[0], row[3]))
+    return sorted(sources, key=operator.itemgetter(3))
+
+
+def get_cache_key(ped_fn, xref_fn=None, sep_in=',', missing_in='.', missing_out='.'):
+    """
+    Key of a pedigree cache: the path, size, mtime and a hash of the first and last MB of each input file
+    and its settings, as by get_sources(), the content of the xref file, and missing_out
+    :return: hex digest
+    :raise OSError, ValueError: an input file could not be read, a sources manifest is malformed
+    """
+    h = hashlib.sha256()
+    h.update(repr((CACHE_MAGIC, missing_out, sys.byteorder, 'xref chained')).encode())
+    for file_name, sep, miss, priority in get_sources(ped_fn, sep_in, missing_in):
+        st = os.stat(file_name)
+        h.update(repr((os.path.abspath(file_name), st.st_size, st.st_mtime_ns, sep, miss, priority)).encode())
+        with open(file_name, 'rb') as fp:
+            h.update(fp.read(1 << 20))
+            if st.st_size > 2 << 20:
+                fp.seek(-(1 << 20), os.SEEK_END)
+                h.update(fp.read())
+    if xref_fn and os.path.exists(xref_fn):
+        with open(xref_fn, 'rb') as fp:
+            h.update(fp.read())
+    return h.hexdigest()
+
+
+_batch_pr = None     # PedRefiner shared by the forked workers of refine_batch()
+
+
+def _run_batch_job(*args):
+    return _batch_pr.refine_job(*args)
+
+
+def get_peak_mem_mb():
+    """
+    :return: peak resident memory of this process in MB, 0 if unknown
+    """
+    if resource is None:
+        return 0.
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == 'darwin':    # bytes on macOS, KB elsewhere
+        return peak / 1048576.
+    return peak / 1024.
+
+
+def _inbreeding(sires, dams):
+    """
+    Inbreeding coefficients, F = a_sd / 2, sire by sire as in Colleau's indirect method (2002): the column of
+    A = T D T' of a sire is computed once for all its offspring, on the ancestors of the sire and of its mates
+    only: the row of T of the sire times D, from the youngest ancestor down, then T times that, from the oldest
+    up. The cost is the number of sires times the size of their ancestry and their mates', against the number of
+    animals times the size of their ancestry for Meuwissen and Luo (1992): near-linear if sires are few or
+    their pedigrees shallow, growing with the depth of the pedigree otherwise.
+    :param sires: array of sire numbers by animal number, 1..n, parents before offspring, 0 for missing; item
+                  0 unused
+    :param dams: same for dams
+    :return: array('d') of F by animal number, item 0 unused
+    """
+    n = len(sires) - 1
+    f = array('d', [0.]) * (n + 1)
+    f[0] = -1.      # D_i = 1/2 - (F_s + F_d)/4 then holds with unknown parents too
+    offspring = {}      # sire -> its offspring of known dam
+    for i in compress(range(n + 1), map(operator.mul, sires, dams)):
+        offspring.setdefault(sires[i], []).append(i)
+    z = array('d', [0.]) * (n + 1)     # row of T of the sire, times D
+    x = array('d', [0.]) * (n + 1)     # column of A of the sire
+    for s, offs in offspring.items():     # in the order of their first offspring: ancestors of s are done
+        seen = {dams[k] for k in offs}
+        seen.add(s)
+        td_lst = list(seen)
+        while td_lst:
+            j = td_lst.pop()
+            p = sires[j]
+            if p and p not in seen:
+                seen.add(p)
+                td_lst.append(p)
+            p = dams[j]
+            if p and p not in seen:
+                seen.add(p)
+                td_lst.append(p)
+        order = sorted(seen, reverse=True)
+        z[s] = 1.
+        for j in order:
+            lj = z[j]
+            if lj:
+                r = .5 * lj
+                z[sires[j]] += r
+                z[dams[j]] += r
+                z[j] = lj * (.5 - .25 * (f[sires[j]] + f[dams[j]]))
+        z[0] = 0.
+        order.reverse()
+        for j in order:
+            x[j] = z[j] + .5 * (x[sires[j]] + x[dams[j]])
+        for k in offs:
+            f[k] = .5 * x[dams[k]]
+        for j in order:
+            x[j] = 0.
+            z[j] = 0.
+    f[0] = 0.
+    return f
+
+
+def _gen_depth(sires, dams):
+    """
+    :return: array('i') of generation depths by animal number: 0 without known parents, else one more than the
+             deeper parent
+    """
+    n = len(sires) - 1
+    depth = array('i', [0]) * (n + 1)
+    depth[0] = -1
+    for i in range(1, n + 1):
+        ds = depth[sires[i]]
+        dd = depth[dams[i]]
+        depth[i] = 1 + (ds if ds > dd else dd)
+    depth[0] = 0
+    return depth
+
+
+def _date_int(x):
+    """
+    :param x: digits of a date, YYYYMMDD, YYYYMM or YYYY
+    :return: int of x, 0 if it is not a date
+    """
+    n = len(x)
+    if n not in (4, 6, 8) or not (x.isdigit() and x.isascii()):
+        return 0
+    if n > 4 and not 1 <= int(x[4:6]) <= 12 or n == 8 and not 1 <= int(x[6:]) <= 31:
+        return 0
+    return int(x)
+
+
+def _parse_births(col, missing=('',)):
+    """
+    :param col: birth dates, as strings: YYYYMMDD, YYYYMM or YYYY, '-' and '/' left out, e.g. YYYY-MM-DD
+    :param missing: values of an unknown date
+    :return: (list of int, the digits of each date, 0 if unknown; list of the positions of the values neither
+             a date nor missing). Dates of one pedigree should be in the same format, they are compared as numbers
+    """
+    col = [x.strip() for x in col]
+    digits = [x.replace('-', '').replace('/', '') for x in col]
+    births = list(map(_date_int, digits))
+    bad = [k for k in compress(range(len(col)), map(operator.not_, births)) if col[k] not in missing]
+    return births, bad
+
+
+def _has_births(text, sep):
+    """
+    :return: True if the first line of text has 4 fields, the 4th being a birth date, parsed or not
+    """
+    end = text.find("\n")
+    return text.count(sep, 0, len(text) if end < 0 else end) == 3
+
+
+def _split_lines(text, sep, maps, hits=None, n_col=3):
+    """
+    Split complete lines into 3 columns of IDs, stripped, with missing values and xref replaced; and a 4th one of
+    birth dates, as they are, if n_col is 4
+    :param text: lines, each ending with a newline
+    :param sep: single-char field separator
+    :param maps: (map_i, map_s, map_d, miss). map_i, map_s, map_d: missing_in -> missing_out and the compiled
+                 xref of the ID, sire and dam columns, one lookup per field; miss: missing_in if the maps only
+                 turn it into missing_out, else None
+    :param hits: one-item list, the number of fields changed by xref added to it
+    :param n_col: number of fields, 3 or 4
+    :return: [col_i, col_s, col_d] (and col_birth), lists of IDs; None if any line is malformed or has an empty ID
+    """
+    if not text:
+        return [[] for _ in range(n_col)]
+    # split at the separators only, the newlines are then in every (n_col - 1)-th field: lines of n_col fields
+    # if there is one in each of those and so none elsewhere. Last field of a line and first of the next one
+    # are split apart together
+    k = n_col - 1
+    fields = text.split(sep)
+    ends = fields[k::k]
+    if len(fields) != k * text.count("\n") + 1 or not all(map(operator.contains, ends, repeat("\n"))):
+        return None
+    parts = "\n".join(ends).split("\n")
+    parts.pop()     # empty, after the last newline
+    cols = [fields[:1] + parts[1::2]] + [fields[i::k] for i in range(1, k)] + [parts[0::2]]
+    if not text.isascii() or any(c in text for c in " \t\r\x0b\x0c\x1c\x1d\x1e\x1f"):
+        cols = [list(map(str.strip, col)) for col in cols]
+    if not all(map(all, cols[:3])):
+        return None
+
+    # an ID not in a map is kept as the same object, so changed fields are counted by identity
+    miss = maps[3]
+    for i in range(3):
+        tab = maps[i]
+        if not tab:
+            continue
+        col = list(map(tab.get, cols[i], cols[i]))
+        if hits is not None and len(tab) > (miss is not None):
+            hits[0] += sum(map(operator.is_not, cols[i], col))
+            if miss is not None:
+                hits[0] -= cols[i].count(miss)
+        cols[i] = col
+    return cols
+
+
+def _intern_col(id2code, id_list, col):
+    """
+    :param id2code: ID -> code
+    :param id_list: code -> ID, new IDs appended
+    :param col: list of ID strings
+    :return: list of codes, new IDs interned in bulk: one dict operation per row, and one more per new ID in a
+             column of mostly known IDs (parents), or per known or repeated ID in a column of mostly new ones
+             (animals)
+    """
+    n_code = len(id_list)
+    n_row = len(col)
+    probe = col[::n_row // 16 or 1]
+    if sum(map(id2code.__contains__, probe)) * 2 > len(probe):
+        # mostly known: looked up, then the new IDs coded in order of appearance
+        codes = list(map(id2code.get, col))
+        if None not in codes:
+            return codes
+        is_new = list(map(operator.is_, codes, repeat(None)))
+        new_ids = list(dict.fromkeys(compress(col, is_new)))
+        new_codes = dict(zip(new_ids, range(n_code, n_code + len(new_ids))))
+        id2code.update(new_codes)
+        id_list.extend(new_ids)
+        for k in compress(range(n_row), is_new):
+            codes[k] = new_codes[col[k]]
+        return codes
+
+    # mostly new: a new ID at row k is given n_code + k. With n_new of them, the codes of the rows below n_new
+    # that are known or repeated IDs are free, they go to the new IDs of the rows past n_new
+    n_dict = len(id2code)
+    codes = list(map(id2code.setdefault, col, range(n_code, n_code + n_row)))
+    n_new = len(id2code) - n_dict
+    new_ids = col[:n_new]
+    if n_new < n_row:
+        is_first = list(map(operator.eq, codes, range(n_code, n_code + n_row)))
+        moved = {}
+        for hole, k in zip(compress(range(n_new), map(operator.not_, is_first)),
+                           compress(range(n_new, n_row), is_first[n_new:])):
+            new_ids[hole] = col[k]
+            id2code[col[k]] = moved[n_code + k] = n_code + hole
+        if moved:       # a moved code is only met from its row on
+            codes[n_new:] = [moved.get(c, c) for c in codes[n_new:]]
+    id_list.extend(new_ids)
+    return codes
+
+
+def _resolve_chains(step):
+    """
+    Follow the chains of ID -> ID rules to their ends. The rules on a cycle are dropped, its IDs kept as they are
+    :param step: dict, ID -> ID
+    :return: (dict ID -> final ID, the keys of step not ending on themselves; list of cycles, lists of IDs)
+    """
+    res = {}
+    cycles = []
+    kept = False        # IDs left on themselves
+    for x, v in step.items():
+        if x in res:
+            continue
+        if v not in step:       # no chain, most rules
+            res[x] = v
+            continue
+        path = []
+        on_path = set()
+        v = x
+        while v in step and v not in res:
+            if v in on_path:
+                cycle = path[path.index(v):]
+                if len(cycle) > 1:      # else an ID -> itself rule
+                    cycles.append(cycle)
+                res.update(zip(cycle, cycle))
+                kept = True
+                break
+            path.append(v)
+            on_path.add(v)
+            v = step[v]
+        end = res.get(v, v)
+        for m in path:
+            res.setdefault(m, end)
+    if kept:
+        res = {k: v for k, v in res.items() if k != v}
+    return res, cycles
+
+
+def _compile_xref(map_a, map_s, map_d):
+    """
+    Compile xref rules into one translation per column, chains resolved: A X Y and A Y Z send X to Z in any
+    column; a sire goes through the A rules, then the S rules, each S step followed by the A rules again;
+    a dam likewise through A and D
+    :param map_a: dict of the A rules, ID -> ID
+    :param map_s: S rules
+    :param map_d: D rules
+    :return: (ID column, sire column, dam column), dicts ID -> final ID; list of cycles, lists of IDs
+    """
+    tab_i, cycles = _resolve_chains(map_a)
+    tabs = [tab_i]
+    for rules in (map_s, map_d):
+        res, cyc = _resolve_chains({x: tab_i.get(y, y) for x, y in rules.items() if x not in tab_i})
+        cycles.extend(cyc)
+        tab = dict(tab_i)
+        if res:
+            tab.update([(x, res[y]) for x, y in tab_i.items() if y in res])
+            tab.update(res)
+        tabs.append(tab)
+    return tabs, cycles
+
+
+def _compose_xref(tabs, tabs_next):
+    """
+    :param tabs: (ID column, sire column, dam column) translations
+    :param tabs_next: translations applied after tabs
+    :return: the translations of tabs followed by tabs_next
+    """
+    ret = []
+    for tab, nxt in zip(tabs, tabs_next):
+        out = {x: nxt.get(y, y) for x, y in tab.items()}
+        for x, y in nxt.items():
+            out.setdefault(x, y)
+        ret.append({x: y for x, y in out.items() if x != y})
+    return ret
+
+
+_parse_conf = None   # (file_name, sep, maps, chunk_size) shared by the forked workers of load_ped()
+
+
+def _parse_range(span):
+    """
+    Parse the lines in a byte range of the pedigree file, in a worker process of load_ped(); parsing stops at
+    the first malformed line. IDs are interned by the parent: coding them locally only to recode every row
+    there costs it as much as interning the strings
+    :param span: (start, end) byte offsets, both at the start of a line or the end of the file
+    :return: (number of lines, xref hits, pieces, malformed line or None), a piece per chunk read being
+             [col_i, col_s, col_d] as from _split_lines()
+    """
+    file_name, sep, maps, chunk_size = _parse_conf
+    start, end = span
+    enc = locale.getpreferredencoding(False)
+    pieces = []
+    n_lines = 0
+    hits = [0]
+    bad = None
+    with open(file_name, 'rb') as fp:
+        fp.seek(start)
+        pos = start
+        tail = b""
+        while pos < end and bad is None:
+            data = fp.read(min(chunk_size, end - pos))
+            if not data:
+                break
+            pos += len(data)
+            data = tail + data
+            cut = data.rfind(b"\n") + 1 if pos < end else len(data)
+            tail = data[cut:]
+            text = data[:cut].decode(enc)
+            if "\r" in text:            # universal newlines, as in text mode
+                text = text.replace("\r\n", "\n").replace("\r", "\n")
+            if text and not text.endswith("\n"):
+                text += "\n"
+            n_lines += text.count("\n")
+            cols = _split_lines(text, sep, maps, hits)
+            if cols is None:            # keep the lines before the first malformed one
+                cols = [[], [], []]
+                for line in text.split("\n")[:-1]:
+                    row = _split_lines(line + "\n", sep, maps, hits)
+                    if row is None:
+                        bad = line
+                        break
+                    for col, x in zip(cols, row):
+                        col.extend(x)
+            pieces.append(cols)
+    return n_lines, hits[0], pieces, bad
+
+
+class PedStats:
+    """
+    Statistics of a PedRefiner run: wall time, CPU time and peak memory per stage, and counts.
+    A stage run more than once (batch jobs, server queries) adds up its times and calls.
+    Stages may be profiled: 'cprofile' dumps <profile_dir>/pedRefiner.<stage>.prof, 'tracemalloc' records
+    the peak of the traced allocations and the top allocating lines.
+    """
+    def __init__(self, profile=None, profile_dir="."):
+        self.stages = OrderedDict()     # name -> {'calls', 'wall', 'cpu', 'peak_mb'}
+        self.counts = OrderedDict()     # name -> int
+        self.sources = []               # counts per input pedigree of a multi-source load_ped()
+        self.profile = profile if profile in ('cprofile', 'tracemalloc') else None
+        self.profile_dir = profile_dir
+        self.profiling = False          # stages are not nested, an inner one is just timed
+
+    @contextmanager
+    def stage(self, name):
+        prof = None
+        own_profile = self.profile is not None and not self.profiling
+        if own_profile:
+            self.profiling = True
+            if self.profile == 'cprofile':
+                prof = cProfile.Profile()
+                prof.enable()
+            else:
+                tracemalloc.start()
+        wall = time.perf_counter()
+        cpu = time.process_time()
+        try:
+            yield
+        finally:
+            st = self.stages.setdefault(name, OrderedDict([('calls', 0), ('wall', 0.), ('cpu', 0.), ('peak_mb', 0.)]))
+            st['calls'] += 1
+            st['wall'] += time.perf_counter() - wall
+            st['cpu'] += time.process_time() - cpu
+            st['peak_mb'] = max(st['peak_mb'], get_peak_mem_mb())
+            if own_profile:
+                if prof is not None:
+                    prof.disable()
+                    prof.dump_stats(os.path.join(self.profile_dir, "pedRefiner.{}.prof".format(name)))
+                else:
+                    top = tracemalloc.take_snapshot().statistics('lineno')[:10]
+                    traced_peak = tracemalloc.get_traced_memory()[1] / 1048576.
+                    st['traced_peak_mb'] = max(st.get('traced_peak_mb', 0.), traced_peak)
+                    st['traced_top'] = [str(x) for x in top]
+                    tracemalloc.stop()
+                self.profiling = False
+
+    def count(self, name, n=1):
+        self.counts[name] = self.counts.get(name, 0) + n
+
+    def as_dict(self):
+        stages = OrderedDict()
+        for name, st in self.stages.items():
+            stages[name] = OrderedDict((k, round(v, 4) if isinstance(v, float) else v) for k, v in st.items())
+        ret = OrderedDict([('stages', stages), ('counts', OrderedDict(self.counts))])
+        if self.sources:
+            ret['sources'] = self.sources
+        return ret
+
+    def save(self, file_name):
+        """
+        :param file_name: JSON file
+        """
+        with open(file_name, 'w') as fp:
+            json.dump(self.as_dict(), fp, indent=1)
+            fp.write("\n")
+
+    def __str__(self):
+        lines = ["{:12} {:>6} {:>9} {:>9} {:>9}".format("stage", "calls", "wall", "cpu", "peak_mb")]
+        for name, st in self.stages.items():
+            lines.append("{:12} {:6} {:9.3f} {:9.3f} {:9.1f}".format(name, st['calls'], st['wall'], st['cpu'],
+                                                                   st['peak_mb']))
+        lines.extend("{}: {}".format(name, n) for name, n in self.counts.items())
+        for src in self.sources:
+            lines.append("source {}: {}".format(src['file'], ", ".join("{} {}".format(k, v) for k, v in src.items()
+                                                                        if k != 'file')))
+        return "\n".join(lines)
+
+
+class PedDiagnostics:
+    """
+    Issues met while loading or checking a pedigree, counted by type. Only the first sample_size of each type
+    are kept, or all of them if keep_all, for the log and the report file. Items are tuples of codes, and of the
+    value in question for bad_birth.
+    """
+    TYPES = OrderedDict([
+        ('self_parent', "self-parent record(s)"),        # (code,)
+        ('duplicate_same', "duplicated (but same) entries"),   # (code,)
+        ('duplicate_diff', "duplicated (yet quite different) entries, version2 used"),   # (code, s1, d1, s2, d2)
+        ('sex_conflict', "IDs used as both sire and dam"),     # (code, times sire, times dam)
+        ('no_record', "parents without a record"),      # (code,)
+        ('born_after', "parents born after their offspring"),  # (code, parent, birth, parent's birth)
+        ('bad_birth', "birth dates not understood, taken as unknown"),     # (code, value)
+    ])
+
+    def __init__(self, sample_size=10, keep_all=False):
+        self.sample_size = sample_size
+        self.keep_all = keep_all
+        self.counts = OrderedDict()
+        self.items = OrderedDict()
+
+    def add(self, kind, item):
+        n = self.counts.get(kind, 0)
+        self.counts[kind] = n + 1
+        if n < self.sample_size or self.keep_all:
+            self.items.setdefault(kind, []).append(item)
+
+    def extend(self, kind, items):
+        """
+        add() of a list of items, in bulk; or of an iterator, counted in one pass without keeping the items
+        beyond the sample unless keep_all
+        """
+        n = self.counts.get(kind, 0)
+        if self.keep_all:
+            keep = list(items)
+            n_item = len(keep)
+        else:
+            items = iter(items)
+            keep = list(islice(items, max(self.sample_size - n, 0)))
+            n_item = len(keep) + sum(1 for _ in items)
+        if not n_item:
+            return
+        self.counts[kind] = n + n_item
+        if keep:
+            self.items.setdefault(kind, []).extend(keep)
+
+    @staticmethod
+    def format(kind, item, ids, sep=","):
+        """
+        :return: list of message lines of one item, as they used to be logged
+        """
+        if kind == 'self_parent':
+            return ["  # I ID {} is same for its parent(s), replaced with missing.".format(ids[item[0]])]
+        if kind == 'duplicate_same':
+            return ["  # D duplicated (but same) entry for {}".format(ids[item[0]])]
+        if kind == 'sex_conflict':
+            return ["  # B ID {} is the sire of {} and the dam of {} records".format(ids[item[0]], *item[1:])]
+        if kind == 'no_record':
+            return ["  # P parent {} has no record".format(ids[item[0]])]
+        if kind == 'born_after':
+            code, parent, born, born_p = item
+            return ["  # T parent {} born {}, after its offspring {} born {}".format(ids[parent], born_p, ids[code],
+                                                                                   born)]
+        if kind == 'bad_birth':
+            return ["  # T birth date '{}' of {} not understood, taken as unknown".format(item[1], ids[item[0]])]
+        code, s1, d1, s2, d2 = item
+        return ["  # D duplicated (yet quite different) entry for {}, force using version2".format(ids[code]),
+                "       version1: {1}{0}{2}{0}{3}".format(sep, ids[code], ids[s1], ids[d1]),
+                "       version2: {1}{0}{2}{0}{3}".format(sep, ids[code], ids[s2], ids[d2])]
+
+    def report(self, log, ids, sep=",", file_name=None, mode='w'):
+        """
+        Log the totals and a sample of each type, and write every item kept into file_name if given
+        :param log: logger
+        :param ids: code -> ID
+        :param mode: 'a' to append to file_name
+        """
+        for kind, n in self.counts.items():
+            items = self.items.get(kind, [])
+            log.warning("  # {} {}".format(n, self.TYPES[kind]))
+            for item in items[:self.sample_size]:
+                for line in self.format(kind, item, ids, sep):
+                    log.warning(line)
+            if n > self.sample_size:
+                log.warning("    ... {} more{}".format(n - self.sample_size,
+                                                        ", listed in " + file_name if file_name else ""))
+        if file_name:
+            with open(file_name, mode) as fp:
+                for kind, items in self.items.items():
+                    for item in items:
+                        fp.write("\n".join(self.format(kind, item, ids, sep)) + "\n")
+
+
+class ClosureCache:
+    """
+    LRU cache of per-animal closures (arrays of codes) for PedRefiner.get_ancestors() and the like, keyed by
+    (kind, code, gen_max). The arrays take at most limit_mb MB in total, the least recently used are evicted.
+    """
+    def __init__(self, limit_mb=64):
+        self.limit = int(limit_mb * 1048576)
+        self.size = 0
+        self.items = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def sizeof(arr):
+        return 64 + arr.itemsize * len(arr)
+
+    def get(self, key):
+        arr = self.items.get(key)
+        if arr is None:
+            self.misses += 1
+            return None
+        self.items.move_to_end(key)
+        self.hits += 1
+        return arr
+
+    def put(self, key, arr):
+        size = self.sizeof(arr)
+        if size > self.limit:
+            return
+        old = self.items.pop(key, None)
+        if old is not None:
+            self.size -= self.sizeof(old)
+        self.items[key] = arr
+        self.size += size
+        while self.size > self.limit:
+            _, old = self.items.popitem(last=False)
+            self.size -= self.sizeof(old)
+
+    def clear(self):
+        self.items.clear()
+        self.size = 0
+
+    def __len__(self):
+        return len(self.items)
+
+
+class PedMapView(Mapping):
+    """
+    Read-only dict-like view of the interned pedigree: ID -> (sire, dam), as strings.
+    Only IDs having a record in the input pedigree are keys.
+    """
+    def __init__(self, pr):
+        self.pr = pr
+
+    def __getitem__(self, idx):
+        pr = self.pr
+        code = pr.id2code.get(idx, 0)
+        if not pr.has_rec[code]:
+            raise KeyError(idx)
+        return pr.id_list[pr.sire[code]], pr.id_list[pr.dam[code]]
+
+    def __contains__(self, idx):
+        return bool(self.pr.has_rec[self.pr.id2code.get(idx, 0)])
+
+    def __iter__(self):
+        pr = self.pr
+        for code in range(1, len(pr.id_list)):
+            if pr.has_rec[code]:
+                yield pr.id_list[code]
+
+    def __len__(self):
+        return self.pr.n_rec
+
+
+class CachedIdList:
+    """
+    code -> ID over a memory-mapped pedigree cache. IDs interned after loading the cache are appended
+    to a regular list.
+    """
+    def __init__(self, blob, base, id_off):
+        self.blob = blob            # UTF-8 IDs, concatenated from offset base on
+        self.base = base
+        self.id_off = id_off        # code -> offset from base, one more for the end
+        self.n_cached = len(id_off) - 1
+        self.extra = []
+
+    def __getitem__(self, code):
+        if code < self.n_cached:
+            return str(self.blob[self.base + self.id_off[code]:self.base + self.id_off[code + 1]], 'utf-8')
+        return self.extra[code - self.n_cached]
+
+    def __len__(self):
+        return self.n_cached + len(self.extra)
+
+    def append(self, idx):
+        self.extra.append(idx)
+
+    def extend(self, ids):
+        self.extra.extend(ids)
+
+
+class CachedIdIndex:
+    """
+    ID -> code over a memory-mapped pedigree cache, by binary search in the codes sorted by ID.
+    IDs interned after loading the cache are kept in a regular dict.
+    """
+    step = 256      # one ID out of step kept in memory, sorted, to start the search from
+
+    def __init__(self, id_list, sorted_codes):
+        self.id_list = id_list
+        self.sorted_codes = sorted_codes
+        self.extra = {}
+        self.sample = None
+
+    def get(self, idx, default=None):
+        if idx in self.extra:
+            return self.extra[idx]
+        blob = self.id_list.blob
+        base = self.id_list.base
+        id_off = self.id_list.id_off
+        sorted_codes = self.sorted_codes
+        n = len(sorted_codes)
+        step = self.step
+        if self.sample is None:
+            self.sample = [bytes(blob[base + id_off[code]:base + id_off[code + 1]])
+                           for code in sorted_codes[::step]]
+        key = idx.encode('utf-8')
+        k = bisect_right(self.sample, key)      # sample[k - 1] <= key < sample[k]
+        lo = (k - 1) * step if k else 0
+        hi = min(k * step, n)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            code = sorted_codes[mid]
+            if blob[base + id_off[code]:base + id_off[code + 1]] < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo < n:
+            code = sorted_codes[lo]
+            if blob[base + id_off[code]:base + id_off[code + 1]] == key:
+                return code
+        return default
+
+    def __getitem__(self, idx):
+        code = self.get(idx)
+        if code is None:
+            raise KeyError(idx)
+        return code
+
+    def __contains__(self, idx):
+        return self.get(idx) is not None
+
+    def __setitem__(self, idx, code):
+        self.extra[idx] = code
+
+    def setdefault(self, idx, code):
+        found = self.get(idx)
+        if found is None:
+            self.extra[idx] = found = code
+        return found
+
+    def update(self, items):
+        self.extra.update(items)
+
+    def __len__(self):
+        return len(self.sorted_codes) + len(self.extra)
+
+
+class SqliteIdIndex:
+    """
+    ID -> code in an SQLite table, in place of the dict while load_ped() runs in disk mode: IDs are interned on
+    disk, within a page cache of cache_mb MB. New IDs get the next codes in order of appearance, as by
+    _intern_col(). Also stands for the code -> ID list until the loaded pedigree is mapped.
+    """
+    def __init__(self, file_name, missing_out, cache_mb=64):
+        self.file_name = file_name
+        self.db = sqlite3.connect(file_name)
+        for pragma in ("journal_mode = OFF", "synchronous = OFF", "locking_mode = EXCLUSIVE", "temp_store = FILE",
+                       "cache_size = {}".format(-int(cache_mb * 1024))):
+            self.db.execute("PRAGMA " + pragma)
+        self.db.execute("CREATE TABLE ids (code INTEGER PRIMARY KEY, id TEXT NOT NULL UNIQUE)")
+        self.db.execute("CREATE TABLE col (id TEXT NOT NULL)")
+        self.db.execute("INSERT INTO ids VALUES (0, ?)", (missing_out,))
+        self.n_code = 1
+
+    def get(self, idx, default=None):
+        row = self.db.execute("SELECT code FROM ids WHERE id = ?", (idx,)).fetchone()
+        return default if row is None else row[0]
+
+    def __getitem__(self, code):
+        row = self.db.execute("SELECT id FROM ids WHERE code = ?", (code,)).fetchone()
+        if row is None:
+            raise IndexError(code)
+        return row[0]
+
+    def __len__(self):
+        return self.n_code
+
+    def intern(self, idx):
+        code = self.get(idx)
+        if code is None:
+            code = self.n_code
+            self.db.execute("INSERT INTO ids VALUES (?, ?)", (code, idx))
+            self.n_code += 1
+        return code
+
+    def intern_col(self, col):
+        """
+        :param col: list of ID strings
+        :return: list of codes, new IDs interned in bulk
+        """
+        db = self.db
+        uniq = list(dict.fromkeys(col))     # parents repeat, each ID goes to SQLite once per column
+        n_old = self.n_code
+        found = None
+        if all(self.get(idx) is None for idx in uniq[:8]):     # new IDs, such as an animal column
+            db.executemany("INSERT OR IGNORE INTO ids (id) VALUES (?)", zip(uniq))
+            self.n_code = db.execute("SELECT max(code) FROM ids").fetchone()[0] + 1
+            if self.n_code - n_old == len(uniq):     # all new, the codes are the next ones in order
+                found = dict(zip(uniq, range(n_old, self.n_code)))
+        if found is None:
+            db.executemany("INSERT INTO col VALUES (?)", zip(uniq))
+            found = dict(db.execute("SELECT col.id, ids.code FROM col JOIN ids USING (id)"))
+            db.execute("DELETE FROM col")
+            new_ids = [idx for idx in uniq if idx not in found]
+            if new_ids:
+                db.executemany("INSERT INTO ids (id) VALUES (?)", zip(new_ids))
+                found.update(zip(new_ids, range(self.n_code, self.n_code + len(new_ids))))
+                self.n_code += len(new_ids)
+        return list(map(found.__getitem__, col))
+
+    def close(self):
+        self.db.close()
+        os.remove(self.file_name)
+
+
+class CodeMap:
+    """
+    code -> int > 0 in insertion order, over an array of the values by code (0 for no key) and an array('i') of
+    the keys: self.opt_map and self.opt_set in disk mode, 1 or 4 bytes per code on disk and 4 per key in memory
+    instead of a dict entry per key. None is stored as 1, as in an OrderedDict used as an ordered set.
+    """
+    def __init__(self, values):
+        self.values = values
+        self.order = array('i')
+
+    def __contains__(self, code):
+        return self.values[code] != 0
+
+    def __getitem__(self, code):
+        value = self.values[code]
+        if not value:
+            raise KeyError(code)
+        return value
+
+    def get(self, code, default=None):
+        return self.values[code] or default
+
+    def __setitem__(self, code, value):
+        if not self.values[code]:
+            self.order.append(code)
+        self.values[code] = 1 if value is None else value
+
+    def update(self, items):
+        for code, value in (items.items() if isinstance(items, Mapping) else items):
+            self[code] = value
+
+    def __iter__(self):
+        return iter(self.order)
+
+    def __len__(self):
+        return len(self.order)
 
 
 class PedRefiner:
@@ -40,19 +1013,43 @@ class PedRefiner:
         self.missing_out = '.'
         self.stem = ""
         self.stem_fault = False
-        fmt = "%(name)s %(asctime)s : %(levelname)-7s | %(message)s"
-        date_fmt = "%H:%M:%S"
-        logging.basicConfig(format=fmt, datefmt=date_fmt, level=logging.DEBUG)
         self.l = logging.getLogger('PedMap')
+        self.stats = PedStats()     # 20261018: per-stage times and counts
+        self.diag = PedDiagnostics()    # self-parents and duplicates met by load_ped()
+        self.diag_sample = 10       # of each type, logged
         # 20150702 mapXref
         self.mapXrefA = {}
         self.mapXrefS = {}
         self.mapXrefD = {}
-        self.mapID2Gender = {}
+        self.mapID2Gender = bytearray(1)   # code -> ord('M') / ord('F') / 0
         # 20150331 -r need mapID2Offspring
-        self.mapID2SetOffspring = {}
-        self.ped_map = {}     # holding original pedigree info
-        self.opt_map = {}     # holding output pedigree set
+        # 20261018: as a CSR index, offspring of code c are off_lst[off_ptr[c]:off_ptr[c + 1]]
+        self.off_ptr = None
+        self.off_lst = None
+        # 20261018: interned pedigree. Every ID is coded once as an int, code 0 being self.missing_out;
+        #           sire/dam are kept in two typed arrays indexed by code
+        self.id_list = [self.missing_out]  # code -> ID
+        self.id2code = {self.missing_out: 0}   # ID -> code
+        self.sire = array('i', [0])        # code -> sire code
+        self.dam = array('i', [0])         # code -> dam code
+        self.has_rec = bytearray(1)        # code -> 1 if the ID has a record in the input pedigree
+        self.birth = None                  # code -> birth date as by _parse_births(), 0 if unknown; None if no
+                                           # input pedigree has a birth-date column
+        self.n_rec = 0
+        self.ped_map = PedMapView(self)    # holding original pedigree info, ID -> (sire, dam)
+        self.opt_map = {}     # holding output pedigree set, code -> generation it was reached at
+        self.opt_pruned = None    # codes of self.opt_map dropped from the output by refine(prune=...), or None
+        self.loop_list = []   # pedigree loops found by check(), lists of codes
+        self.conflict_list = []   # codes used as both sire and dam found by check()
+        self.cnt_s = None     # code -> number of records having it as sire, kept by check() for apply_delta()
+        self.cnt_d = None     # code -> number of records having it as dam
+        self.cache_mm = None  # memory-mapped pedigree cache, if loaded from one
+        self.disk_dir = None  # disk mode if set: the code-indexed arrays are memory-mapped files in this directory
+        self.memo = ClosureCache(64)   # closures of get_ancestors(), get_descendants(), get_relatives()
+        self.batch_order = None   # sorted ancestry of the gen_max == 0 jobs of refine_batch()
+        self.chunk_size = 1 << 20   # characters read at a time by load_ped()
+        self.sqlite_cache_mb = 64   # page cache of the ID table of load_ped() in disk mode
+        self.write_block = 10000    # records written at a time
 #        self.opt_vec = []
 #        self.opt_set = set()
         self.opt_set = OrderedDict()
@@ -61,6 +1058,8 @@ class PedRefiner:
 
     def load_xref_map(self, file_name):
         """
+        Load a xref file, compiled into one translation per column: mapXrefA for the ID column, mapXrefS for
+        the sire column, mapXrefD for the dam column, chains of rules resolved to their ends
         :param: file_name
         :return: bool, True if success
         """
@@ -68,182 +1067,1415 @@ class PedRefiner:
         self.mapXrefA = {}
         self.mapXrefS = {}
         self.mapXrefD = {}
-        if os.path.exists(file_name):
-            ret = True
-            with open(file_name, 'r') as fp:
-                for line in fp:
-                    vec_tmp = line.split()
-                    if not vec_tmp[0] or vec_tmp[0][0] == "#":  # ignore empty or comment lines
-                        continue
-                    if len(vec_tmp) != 3:
-                        self.l.error("PedMap::load_xref_map() ERROR - xref file {} is not a 3-col-through file."
-                                     .format(file_name))
-                        self.l.error("PedMap::load_xref_map() ERROR - line content [{}] contains {} fields."
-                                     .format(line, len(vec_tmp)))
-                        ret = False
+        with self.stats.stage('xref'):
+            xref = self.__read_xref(file_name)
+            if xref is not None:
+                (self.mapXrefA, self.mapXrefS, self.mapXrefD), ret = xref
+        return ret
+
+    def __read_xref(self, file_name):
+        """
+        Read and compile a xref file. The rules of a cycle, as A X Y and A Y X, are dropped and logged
+        :return: ([ID column, sire column, dam column] translations as by _compile_xref(), bool True if no error);
+                 None if the file does not exist
+        """
+        if not file_exists(file_name):
+            return None
+        ret = True
+        rules = {'A': {}, 'S': {}, 'D': {}}
+        with open_file(file_name, 'r') as fp:
+            for line in fp:
+                vec_tmp = line.split()
+                if not vec_tmp or vec_tmp[0][0] == "#":  # ignore empty or comment lines
+                    continue
+                if len(vec_tmp) != 3:
+                    self.l.error("PedMap::load_xref_map() ERROR - xref file {} is not a 3-col-through file."
+                                 .format(file_name))
+                    self.l.error("PedMap::load_xref_map() ERROR - line content [{}] contains {} fields."
+                                 .format(line, len(vec_tmp)))
+                    ret = False
+                    break
+
+                if vec_tmp[0] in rules:
+                    rules[vec_tmp[0]][vec_tmp[1]] = vec_tmp[2]
+                else:
+                    self.l.warning('PedMap::loadXrefMap() WARNING - unknown command "{}", ignored'
+                                   .format(line))
+
+        tabs, cycles = _compile_xref(rules['A'], rules['S'], rules['D'])
+        for cycle in cycles:
+            self.l.error("PedMap::load_xref_map() ERROR - xref file {}: cycle {}, its rules ignored"
+                         .format(file_name, " -> ".join(cycle + cycle[:1])))
+            ret = False
+        return tabs, ret
+
+    def reset_ped(self):
+        """
+        Drop the loaded pedigree and all the IDs interned so far
+        """
+        self.id_list = [self.missing_out]
+        self.id2code = {self.missing_out: 0}
+        self.sire = array('i', [0])
+        self.dam = array('i', [0])
+        self.has_rec = bytearray(1)
+        self.birth = None
+        self.n_rec = 0
+        self.mapID2Gender = bytearray(1)
+        self.off_ptr = None
+        self.off_lst = None
+        self.cnt_s = None
+        self.cnt_d = None
+        self.cache_mm = None
+        self.disk_dir = None
+        self.memo.clear()
+        self.opt_map = {}
+        self.opt_set = OrderedDict()
+
+    def save_cache(self, file_name, key=""):
+        """
+        Save the loaded and checked pedigree into a binary file, to be memory-mapped by load_cache().
+        Layout, after the header: sire and dam (int32 per code), has_rec and gender (byte per code),
+        ID offsets (int64 per code, plus one), codes sorted by ID (int32 per code), UTF-8 IDs.
+        Sections are padded to 8 bytes.
+        :param file_name: cache file name, written through a temporary file
+        :param key: cache key, as from get_cache_key(), stored in the header
+        :return: bool, True if success
+        """
+        n_code = len(self.id_list)
+        ids = self.id_list
+        if isinstance(ids, CachedIdList) and not ids.extra:    # the ID table as mapped, in disk mode above all
+            id_off = ids.id_off
+            sorted_codes = self.id2code.sorted_codes
+        else:
+            id_off = array('q', accumulate((len(ids[code].encode('utf-8')) for code in range(n_code)), initial=0))
+            sorted_codes = array('i', sorted(range(n_code), key=ids.__getitem__))  # UTF-8 keeps code point order
+        tmp_name = "{}.{}.tmp".format(file_name, os.getpid())
+        try:
+            with open(tmp_name, 'wb') as fp:
+                fp.write(CACHE_HEADER.pack(CACHE_MAGIC, n_code, self.n_rec, id_off[-1], key.encode()[:64]))
+                for arr in (self.sire[:n_code], self.dam[:n_code], self.has_rec[:n_code],
+                            self.mapID2Gender[:n_code], id_off, sorted_codes):
+                    fp.write(arr)
+                    fp.write(bytes(-fp.tell() % 8))
+                if isinstance(ids, CachedIdList) and id_off is ids.id_off:
+                    for start in range(0, id_off[-1], 1 << 24):
+                        fp.write(ids.blob[ids.base + start:ids.base + min(start + (1 << 24), id_off[-1])])
+                else:
+                    for start in range(0, n_code, 1 << 20):
+                        fp.write("".join(ids[code] for code in range(start, min(start + (1 << 20), n_code)))
+                                 .encode('utf-8'))
+            os.replace(tmp_name, file_name)
+        except OSError as e:
+            self.l.error("  * Error writing pedigree cache {}: {}".format(file_name, e))
+            if os.path.exists(tmp_name):
+                os.remove(tmp_name)
+            return False
+        self.l.debug("pedigree cache {} saved, {} IDs".format(file_name, n_code))
+        return True
+
+    def load_cache(self, file_name, key=None, disk_dir=None):
+        """
+        Load a pedigree saved by save_cache(), in place of load_ped() and check(). The ID table stays in
+        the memory-mapped file, sire/dam/has_rec/gender are copied into arrays.
+        :param file_name: cache file name
+        :param key: if given, the cache key stored in the header must be the same
+        :param disk_dir: if given, disk mode: sire/dam/has_rec/gender stay in the file too, mapped copy-on-write,
+                         and the arrays made later go into memory-mapped files in disk_dir
+        :return: bool, True if success
+        """
+        self.isValid = False
+        try:
+            with open(file_name, 'rb') as fp:
+                mm = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ if disk_dir is None else mmap.ACCESS_COPY)
+        except (OSError, ValueError) as e:
+            self.l.error("  * Error reading pedigree cache {}: {}".format(file_name, e))
+            return False
+        self.isValid = self.__map_cache(mm, file_name, key, disk_dir)
+        if self.isValid:
+            self.l.debug("pedigree cache {} loaded, {} IDs, {} records".format(file_name, len(self.id_list),
+                                                                               self.n_rec))
+        return self.isValid
+
+    def __map_cache(self, mm, file_name, key=None, disk_dir=None):
+        """
+        Take the pedigree from a mapped cache, see load_cache()
+        :return: bool, True if success
+        """
+        if len(mm) < CACHE_HEADER.size:
+            self.l.error("  * Error reading pedigree cache {}: truncated".format(file_name))
+            return False
+        magic, n_code, n_rec, n_blob, key_saved = CACHE_HEADER.unpack_from(mm, 0)
+        if magic != CACHE_MAGIC:
+            self.l.error("  * Error reading pedigree cache {}: not a pedRefiner cache".format(file_name))
+            return False
+        if key is not None and key_saved.rstrip(b"\0") != key.encode()[:64]:
+            self.l.error("  * Error reading pedigree cache {}: key mismatch".format(file_name))
+            return False
+
+        mv = memoryview(mm)
+        pos = CACHE_HEADER.size
+        sections = []
+        for item_size in (4, 4, 1, 1, 8, 4):
+            n_item = n_code + 1 if item_size == 8 else n_code
+            sections.append(mv[pos:pos + item_size * n_item])
+            pos += item_size * n_item
+            pos += -pos % 8
+        if pos + n_blob != len(mm):
+            self.l.error("  * Error reading pedigree cache {}: truncated".format(file_name))
+            return False
+
+        self.reset_ped()
+        if disk_dir is None:
+            self.sire = array('i')
+            self.sire.frombytes(sections[0])
+            self.dam = array('i')
+            self.dam.frombytes(sections[1])
+            self.has_rec = bytearray(sections[2])
+            self.mapID2Gender = bytearray(sections[3])
+        else:
+            self.disk_dir = disk_dir
+            self.sire = sections[0].cast('i')
+            self.dam = sections[1].cast('i')
+            self.has_rec = sections[2]
+            self.mapID2Gender = sections[3]
+        self.id_list = CachedIdList(mm, pos, sections[4].cast('q'))
+        self.id2code = CachedIdIndex(self.id_list, sections[5].cast('i'))
+        self.n_rec = n_rec
+        self.cache_mm = mm
+        self.missing_out = self.id_list[0]
+        return True
+
+    def get_code(self, idx):
+        """
+        :param idx: ID string
+        :return: int code of idx, 0 if idx is missing or unknown
+        """
+        return self.id2code.get(idx, 0)
+
+    def __reserve(self, n_code):
+        """
+        Make sure the code-indexed arrays hold at least n_code items. They are over-allocated,
+        len(self.id_list) is the actual number of codes
+        """
+        n_old = len(self.has_rec)
+        if n_old < n_code:
+            n_new = n_old + max(n_code - n_old, n_old)
+            self.sire = self.__grow(self.sire, n_new)
+            self.dam = self.__grow(self.dam, n_new)
+            self.has_rec = self.__grow(self.has_rec, n_new)
+            self.mapID2Gender = self.__grow(self.mapID2Gender, n_new)
+            if self.birth is not None:
+                self.birth = self.__grow(self.birth, n_new)
+
+    def __use_birth(self):
+        """
+        Make self.birth ready for the birth dates of a pedigree
+        """
+        if self.birth is None:
+            self.birth = self.__code_array('i', len(self.has_rec))
+
+    def __trim(self):
+        n_code = len(self.id_list)
+        if self.disk_dir is None:
+            del self.sire[n_code:]
+            del self.dam[n_code:]
+            del self.has_rec[n_code:]
+            del self.mapID2Gender[n_code:]
+            if self.birth is not None:
+                del self.birth[n_code:]
+        else:
+            self.sire = self.sire[:n_code]
+            self.dam = self.dam[:n_code]
+            self.has_rec = self.has_rec[:n_code]
+            self.mapID2Gender = self.mapID2Gender[:n_code]
+            if self.birth is not None:
+                self.birth = self.birth[:n_code]
+
+    # 20261018: disk mode
+    def __code_array(self, typecode, n):
+        """
+        :param typecode: 'i' or 'B'
+        :return: n zeros, an array('i') or a bytearray; in disk mode a memory-mapped file in self.disk_dir
+        """
+        if self.disk_dir is not None:
+            return _disk_array(self.disk_dir, typecode, n)
+        return array('i', [0]) * n if typecode == 'i' else bytearray(n)
+
+    def __grow(self, arr, n):
+        """
+        :return: arr with n items at least, the new ones 0; extended in place unless memory-mapped
+        """
+        n_old = len(arr)
+        if n_old >= n:
+            return arr
+        if isinstance(arr, memoryview):
+            ret = _disk_array(self.disk_dir or tempfile.gettempdir(), arr.format, n)
+            ret[:n_old] = arr
+            return ret
+        arr.extend(array('i', [0]) * (n - n_old) if isinstance(arr, array) else bytearray(n - n_old))
+        return arr
+
+    def __intern(self, idx):
+        if isinstance(self.id2code, SqliteIdIndex):
+            code = self.id2code.intern(idx)
+            self.__reserve(code + 1)
+            return code
+        code = self.id2code.get(idx)
+        if code is None:
+            code = len(self.id_list)
+            self.id2code[idx] = code
+            self.id_list.append(idx)
+            self.__reserve(code + 1)
+        return code
+
+    def __intern_col(self, col):
+        """
+        :param col: list of ID strings
+        :return: list of codes, new IDs interned in bulk
+        """
+        if isinstance(self.id2code, SqliteIdIndex):
+            codes = self.id2code.intern_col(col)
+        else:
+            codes = _intern_col(self.id2code, self.id_list, col)
+        self.__reserve(len(self.id_list))
+        return codes
+
+    def load_ped(self, file_name, sep=",", missing_in='.', missing_out='.', n_proc=1, report_fn=None,
+                 disk_dir=None):
+        """
+        :param file_name: input pedigree file, 3 col, or 4 if the first line has 4 fields: ID, sire, dam and birth
+                          date, see _parse_births(), a date not understood being reported and taken as unknown; or
+                          several, '@' followed by a sources manifest or a list of sources, as by get_sources():
+                          merged in one pass each, in order of priority, a record replacing the one of the same ID
+                          from an earlier source, counted per source in self.stats.sources
+        :param sep: field separator
+        :param missing_in: missing value in the file
+        :param missing_out: missing value kept inside and written out
+        :param n_proc: number of processes parsing the file, by newline-aligned byte ranges; this one still interns
+                       every ID, taking about the CPU time of a load in one process
+        :param report_fn: file listing every self-parent and duplicate, only a sample of them is logged
+        :param disk_dir: if given, disk mode: IDs are interned through an SQLite table in disk_dir, the arrays
+                         are memory-mapped files there, and the loaded pedigree is mapped as by load_cache();
+                         one process
+        :return: bool, True if success
+        """
+        self.missing_in = missing_in
+        self.missing_out = missing_out
+        self.reset_ped()
+        self.isValid = False
+        if report_fn == 'None':
+            report_fn = None
+        self.diag = PedDiagnostics(self.diag_sample, keep_all=report_fn is not None)
+        try:
+            sources = get_sources(file_name, sep, missing_in)
+        except ValueError as e:
+            self.l.error("  * Error reading ped file: {}".format(e))
+            return False
+        if len(sources) > 1:
+            for src in sources:
+                if not file_exists(src[0]):
+                    self.l.error("  * Error reading ped file: source {} not found".format(src[0]))
+                    return False
+        if sources and file_exists(sources[0][0]):
+            t_start = time.time()
+            counts = self.stats.counts
+            counts['xref_hits'] = 0
+            hits = [0]
+            n_proc = int(n_proc)
+            if n_proc > 1 and 'fork' not in multiprocessing.get_all_start_methods():
+                self.l.warning("  # fork not available, loading the pedigree in one process")
+                n_proc = 1
+            with self.stats.stage('load_ped'):
+                if disk_dir is not None:
+                    n_lines = self.__load_disk(sources, hits, disk_dir)
+                else:
+                    n_lines = self.__load_sources(sources, hits, n_proc)
+                self.__trim()
+            self.missing_in = missing_in
+            self.diag.report(self.l, self.id_list, sep, report_fn)
+            counts['lines'] = n_lines
+            counts['records'] = self.n_rec
+            counts['duplicates'] = self.diag.counts.get('duplicate_same', 0) + \
+                self.diag.counts.get('duplicate_diff', 0)
+            counts['self_parents'] = self.diag.counts.get('self_parent', 0)
+            if self.birth is not None:
+                counts['bad_births'] = self.diag.counts.get('bad_birth', 0)
+            counts['xref_hits'] += hits[0]
+            t_used = max(time.time() - t_start, 1e-6)
+            self.l.debug("{} lines loaded in {:.2f} s, {:.0f} lines/s, peak memory {:.1f} MB"
+                         .format(n_lines, t_used, n_lines / t_used, get_peak_mem_mb()))
+        return self.isValid
+
+    def __get_maps(self):
+        """
+        :return: (map_i, map_s, map_d, miss) for _split_lines(), from the xref maps and self.missing_in
+        """
+        # missing_in -> missing_out -> xref, in one lookup per field
+        maps = [self.mapXrefA, self.mapXrefS, self.mapXrefD]
+        if self.missing_in != self.missing_out or any(self.missing_out in tab for tab in maps):
+            maps = [dict(tab) for tab in maps]
+            for tab in maps:
+                tab[self.missing_in] = tab.get(self.missing_out, self.missing_out)
+        miss = None
+        if self.missing_in != self.missing_out and \
+                not any(self.missing_out in tab for tab in (self.mapXrefA, self.mapXrefS, self.mapXrefD)):
+            miss = self.missing_in
+        return tuple(maps) + (miss,)
+
+    def __load_sources(self, sources, hits, n_proc=1):
+        """
+        Load the sources one after the other into the same pedigree, each streamed as by __load_serial(), or
+        __load_parallel() if n_proc > 1. Per-source counts go to self.stats.sources if there are several
+        :param sources: list of (file name, sep, missing_in, priority), as from get_sources()
+        :return: number of lines read
+        """
+        self.stats.sources = []
+        diag_counts = self.diag.counts
+        n_lines = 0
+        for file_name, sep, missing_in, priority in sources:
+            self.missing_in = missing_in
+            maps = self.__get_maps()
+            n_rec = self.n_rec
+            n_dup = diag_counts.get('duplicate_same', 0) + diag_counts.get('duplicate_diff', 0)
+            n_hit = hits[0] + self.stats.counts['xref_hits']
+            if n_proc > 1 and len(sep) == 1 and is_plain_file(file_name) and \
+                    os.path.getsize(file_name) > 2 * self.chunk_size and \
+                    not self.__source_has_births(file_name, sep):    # birth dates are loaded serially
+                n = self.__load_parallel(file_name, sep, maps, hits, n_proc)
+            else:
+                n = self.__load_serial(file_name, sep, maps, hits)
+            n_lines += n
+            if len(sources) > 1:
+                self.stats.sources.append(OrderedDict([
+                    ('file', file_name), ('priority', priority), ('lines', n), ('records', self.n_rec - n_rec),
+                    ('duplicates', diag_counts.get('duplicate_same', 0) + diag_counts.get('duplicate_diff', 0) -
+                     n_dup),
+                    ('xref_hits', hits[0] + self.stats.counts['xref_hits'] - n_hit)]))
+                self.l.debug("source {}: {} lines, {} new records".format(file_name, n, self.n_rec - n_rec))
+            if not self.isValid:
+                break
+        return n_lines
+
+    def __source_has_births(self, file_name, sep):
+        """
+        :return: True if the first line of a plain file has a birth date, see _has_births()
+        """
+        with open(file_name, 'r') as fp:
+            return _has_births(fp.readline(), sep)
+
+    def __load_serial(self, file_name, sep, maps, hits):
+        """
+        20261018: streaming, chunk by chunk, instead of fp.read().splitlines(): about half the peak memory of the
+                  original dict-of-tuples loader, at about its speed, interning 3 IDs per line taking most of it
+        :return: number of lines read
+        """
+        n_lines = 0
+        n_col = None        # from the first line, 4 if it has a birth date field
+        self.isValid = True
+        with open_file(file_name, 'r') as fp:
+            tail = ""
+            while True:
+                chunk = fp.read(self.chunk_size)
+                if not chunk:
+                    break
+                text = tail + chunk
+                cut = text.rfind("\n") + 1
+                tail = text[cut:]           # incomplete last line, completed by the next chunk
+                text = text[:cut]
+                if n_col is None:
+                    n_col = 4 if _has_births(text or tail, sep) else 3
+                    if n_col == 4:
+                        self.__use_birth()
+                n_lines += text.count("\n")
+                if not self.__load_text(text, sep, maps, hits, n_col):
+                    self.isValid = False
+                    break
+            if self.isValid and tail:
+                n_lines += 1
+                self.isValid = self.__load_line(tail, sep, n_col)
+        return n_lines
+
+    def __load_disk(self, sources, hits, disk_dir):
+        """
+        __load_sources() in disk mode, then the pedigree written in the layout of save_cache() into a temporary
+        file of disk_dir and mapped from there
+        :return: number of lines read
+        """
+        fd, db_name = tempfile.mkstemp(suffix=".sqlite", prefix="pedRefiner.", dir=disk_dir)
+        os.close(fd)
+        self.disk_dir = disk_dir
+        self.id2code = self.id_list = index = SqliteIdIndex(db_name, self.missing_out, self.sqlite_cache_mb)
+        try:
+            n_lines = self.__load_sources(sources, hits)
+            self.__trim()
+            db = index.db
+            n_code = len(index)
+            n_blob = db.execute("SELECT total(length(CAST(id AS BLOB))) FROM ids").fetchone()[0]
+            with tempfile.TemporaryFile(dir=disk_dir, prefix="pedRefiner.") as fp:
+                fp.write(CACHE_HEADER.pack(CACHE_MAGIC, n_code, self.n_rec, int(n_blob), b""))
+                for arr in (self.sire, self.dam, self.has_rec, self.mapID2Gender):
+                    fp.write(arr)
+                    fp.write(bytes(-fp.tell() % 8))
+                fp.write(array('q', [0]))
+                off = 0
+                cur = db.execute("SELECT length(CAST(id AS BLOB)) FROM ids ORDER BY code")
+                for rows in iter(lambda: cur.fetchmany(1 << 16), []):
+                    arr = array('q', accumulate((n for n, in rows), initial=off))[1:]
+                    off = arr[-1]
+                    fp.write(arr)
+                fp.write(bytes(-fp.tell() % 8))
+                cur = db.execute("SELECT code FROM ids ORDER BY id")    # memcmp of UTF-8, as CachedIdIndex
+                for rows in iter(lambda: cur.fetchmany(1 << 16), []):
+                    fp.write(array('i', (code for code, in rows)))
+                fp.write(bytes(-fp.tell() % 8))
+                cur = db.execute("SELECT id FROM ids ORDER BY code")
+                for rows in iter(lambda: cur.fetchmany(1 << 16), []):
+                    fp.write("".join([idx for idx, in rows]).encode('utf-8'))
+                fp.flush()
+                mm = mmap.mmap(fp.fileno(), 0)
+        finally:
+            index.close()
+        is_valid = self.isValid
+        birth = self.birth
+        self.__map_cache(mm, "in " + disk_dir, None, disk_dir)
+        self.isValid = is_valid
+        self.birth = birth
+        self.l.debug("pedigree mapped in disk mode, {} IDs, SQLite cache {} MB".format(n_code, self.sqlite_cache_mb))
+        return n_lines
+
+    def __load_parallel(self, file_name, sep, maps, hits, n_proc):
+        """
+        Parse newline-aligned byte ranges of the file in n_proc forked processes, then merge them here in
+        file order, so that duplicates and self-parents are resolved and reported just as by __load_serial().
+        Interning the IDs, most of the load, stays here: this process takes about the CPU time of
+        __load_serial(), reading and splitting the lines off it being about what receiving the columns costs
+        :return: number of lines read
+        """
+        global _parse_conf
+        size = os.path.getsize(file_name)
+        n_span = n_proc * 4     # more ranges than processes, merging overlaps parsing
+        bounds = [0]
+        with open(file_name, 'rb') as fp:
+            for k in range(1, n_span):
+                fp.seek(max(size * k // n_span, bounds[-1]))
+                fp.readline()       # to the start of the next line
+                if bounds[-1] < fp.tell() < size:
+                    bounds.append(fp.tell())
+        bounds.append(size)
+
+        n_lines = 0
+        self.isValid = True
+        _parse_conf = (file_name, sep, maps, self.chunk_size)
+        try:
+            with multiprocessing.get_context('fork').Pool(n_proc) as pool:
+                for n, n_hit, pieces, bad in pool.imap(_parse_range, zip(bounds[:-1], bounds[1:])):
+                    n_lines += n
+                    hits[0] += n_hit
+                    for c_i, c_s, c_d in pieces:    # interned as by __load_text(), animals first
+                        c_i = self.__intern_col(c_i)
+                        c_s = self.__intern_col(c_s)
+                        self.__load_codes(c_i, c_s, self.__intern_col(c_d))
+                    if bad is not None:
+                        self.isValid = self.__load_line(bad, sep, 3)
                         break
+        finally:
+            _parse_conf = None
+        self.l.debug("pedigree parsed in {} byte ranges by {} processes".format(len(bounds) - 1, n_proc))
+        return n_lines
 
-                    if vec_tmp[0] == "A":
-                        self.mapXrefA[vec_tmp[1]] = vec_tmp[2]
-                    elif vec_tmp[0] == "S":
-                        self.mapXrefS[vec_tmp[1]] = vec_tmp[2]
-                    elif vec_tmp[0] == "D":
-                        self.mapXrefD[vec_tmp[1]] = vec_tmp[2]
-                    else:
-                        self.l.warning('PedMap::loadXrefMap() WARNING - unknown command "{}", ignored'
-                                       .format(line))
+    def __load_text(self, text, sep, maps, hits, n_col=3):
+        """
+        Load a bulk of complete lines column by column. The whole bulk goes through __load_line() if any line
+        is malformed
+        :param text: lines, each ending with a newline
+        :param sep: field separator
+        :param maps: (map_i, map_s, map_d, miss) as for _split_lines()
+        :param hits: one-item list, xref hits added to it
+        :param n_col: number of fields, 4 with birth dates
+        :return: bool, True if success
+        """
+        cols = _split_lines(text, sep, maps, hits, n_col) if len(sep) == 1 else None
+        if cols is None:
+            load_line = self.__load_line
+            for line in text.split("\n")[:-1]:
+                if not load_line(line, sep, n_col):
+                    return False
+            return True
 
-        return ret
+        # animals interned first, so that new animals of this bulk get consecutive codes
+        col_i = self.__intern_col(cols[0])
+        col_s = self.__intern_col(cols[1])
+        col_d = self.__intern_col(cols[2])
+        self.__load_codes(col_i, col_s, col_d)
+        if n_col == 4:      # a known date replaces the one loaded before
+            births, bad = _parse_births(cols[3], ('', self.missing_in))
+            self.diag.extend('bad_birth', [(col_i[k], cols[3][k].strip()) for k in bad if col_i[k]])
+            birth = self.birth
+            for code, born in compress(zip(col_i, births), births):
+                if code:
+                    birth[code] = born
+        return True
 
-    def load_ped(self, file_name, sep=",", missing_in='.', missing_out='.'):
-        self.missing_in = missing_in
-        self.missing_out = missing_out
-        self.ped_map = {}
-        self.isValid = False
-        if os.path.exists(file_name):
-            with open(file_name, 'r') as fp:
-                line_vec = fp.read().splitlines()
+    def __load_codes(self, col_i, col_s, col_d):
+        """
+        Store records given as columns of codes, in order. Runs of consecutive codes, as the new animals of a
+        bulk mostly are, are stored by slices if new; records that need a message (self-parents, duplicates) go
+        through __load_record()
+        """
+        n_row = len(col_i)
+        if not n_row:
+            return
+        cuts = [0]      # where the runs start
+        cuts.extend(compress(range(1, n_row), map(operator.ne, map(operator.sub, islice(col_i, 1, None), col_i),
+                                                  repeat(1))))
+        cuts.append(n_row)
+        if len(cuts) > n_row // 8 + 2 or any(map(operator.eq, col_i, col_s)) or \
+                any(map(operator.eq, col_i, col_d)):
+            self.__load_rows(col_i, col_s, col_d)
+            return
+        has_rec = self.has_rec
+        for lo, hi in zip(cuts, islice(cuts, 1, None)):
+            c_0 = col_i[lo]
+            c_1 = c_0 + hi - lo
+            if c_0 and 1 not in bytes(has_rec[c_0:c_1]):
+                # new and distinct, no self-parents: codes c_0 ... c_1 - 1, in order
+                has_rec[c_0:c_1] = b"\x01" * (hi - lo)
+                self.sire[c_0:c_1] = array('i', col_s[lo:hi])
+                self.dam[c_0:c_1] = array('i', col_d[lo:hi])
+                self.n_rec += hi - lo
+            else:
+                self.__load_rows(col_i[lo:hi], col_s[lo:hi], col_d[lo:hi])
 
-            self.isValid = True
-            for line in line_vec:
-                if not self.__load_line(line, sep):    # get rid of \n
-                    self.isValid = False
-                    break
-        return self.isValid
+    def __load_rows(self, col_i, col_s, col_d):
+        """
+        __load_codes() row by row
+        """
+        has_rec = self.has_rec
+        ped_s = self.sire
+        ped_d = self.dam
+        load_record = self.__load_record
+        n_new = 0
+        for code, c_s, c_d in zip(col_i, col_s, col_d):
+            if not code:
+                continue
+            if has_rec[code] or code == c_s or code == c_d:
+                load_record(code, c_s, c_d)
+                continue
+            has_rec[code] = 1
+            ped_s[code] = c_s
+            ped_d[code] = c_d
+            n_new += 1
+        self.n_rec += n_new
 
-    def __load_line(self, line, sep=","):
+    def __load_line(self, line, sep=",", n_col=3):
+        """
+        :param n_col: number of fields of the source, 4 if its first line has a birth date; a line of 3 fields
+                      is taken as having no birth date
+        """
         ret = True
         len_x = 1 + line.count(sep)
-        if len_x == 3:
+        if len_x == 3 or len_x == n_col:
             vec_tmp = line.split(sep)
-            for i in range(3):
-                idx = vec_tmp[i].strip()
-                if idx == self.missing_in:
-                    idx = self.missing_out
-                # 20150702 mapXref
-                if idx in self.mapXrefA:   # vec_tmp[i] is in the xrefA map
-                    idx = self.mapXrefA[idx]
-                if not idx:
-                    self.l.error("  * Error reading ped file: empty field detected, in line '{}'".format(line))
-                    ret = False
-                vec_tmp[i] = idx
+            births, bad = _parse_births(vec_tmp[3:], ('', self.missing_in))
+            born = vec_tmp[3:]
+            del vec_tmp[3:]
+            if not self.__map_fields(vec_tmp):
+                self.l.error("  * Error reading ped file: empty field detected, in line '{}'".format(line))
+                ret = False
             idx, sire, dam = vec_tmp
-            if sire in self.mapXrefS:       # vec_tmp[1] is in the xrefS map
-                sire = self.mapXrefS[sire]
-            if dam in self.mapXrefD:       # vec_tmp[2] is in the xrefD map
-                dam = self.mapXrefD[dam]
 
             if idx != self.missing_out:
-                p = (sire, dam)
-                if idx in p:
-                    self.l.warning("  # I ID {} is same for its parent(s), replaced with missing.".format(idx))
-                    if idx == sire:
-                        sire = self.missing_out
-                    if idx == dam:
-                        dam = self.missing_out
-                    p = (sire, dam)
-
-                if idx not in self.ped_map:            # new entry
-                    self.ped_map[idx] = p
-                # duplicated but same record, just return: no-missing stored first
-                # 20150729: partly canceled. overriding using new entry
-                elif self.ped_map[idx][0] == sire and self.ped_map[idx][1] == dam:  # same
-                    self.l.warning("  # D duplicated (but same) entry for {}".format(idx))
-
-                # 20150612: override empty entry
-                # 20150729: canceled. overriding using new entry
-                else:
-                    self.l.warning("  # D duplicated (yet quite different) entry for {}, force using version2"
-                                   .format(idx))
-                    self.l.warning("       version1: {0}{2}{1[0]}{2}{1[1]}".format(idx, self.ped_map[idx], sep))
-                    self.ped_map[idx] = p
-                    self.l.warning("       version2: {0}{2}{1[0]}{2}{1[1]}".format(idx, self.ped_map[idx], sep))
+                code = self.__intern(idx)
+                self.__load_record(code, self.__intern(sire), self.__intern(dam))
+                if births and births[0]:
+                    self.birth[code] = births[0]
+                elif bad:
+                    self.diag.add('bad_birth', (code, born[0].strip()))
         else:
-            self.l.error("  * Error reading ped file: not a 3-col csv file, line {}".format(line))
+            self.l.error("  * Error reading ped file: not a 3-col csv file (4 with birth dates), line {}"
+                         .format(line))
             self.l.error("    number of columns read: {}".format(len_x))
             ret = False
 
         return ret
 
-    def check(self):
+    def __map_fields(self, vec_tmp):
+        """
+        Strip the 3 fields of a record and apply missing_in and the xref maps, in place
+        :param vec_tmp: [ID, sire, dam]
+        :return: bool, False if a field is empty
+        """
         ret = True
-        if not self.isValid:
-            self.l.warning("  * Errors occurred while reading pedigree.")
-            ret = False
+        for i, tab in enumerate((self.mapXrefA, self.mapXrefS, self.mapXrefD)):
+            idx = vec_tmp[i].strip()
+            if idx == self.missing_in:
+                idx = self.missing_out
+            # 20150702 mapXref, compiled per column by load_xref_map()
+            if idx in tab:
+                idx = tab[idx]
+                self.stats.count('xref_hits')
+            if not idx:
+                ret = False
+            vec_tmp[i] = idx
+        return ret
 
-        map_s2i = {}
-        map_d2i = {}   # map Sire/Dam 2 Integer(count)
-        self.mapID2Gender = {}
-
-        # filling the sets
-        # self.l.debug("filling maps[ID -> parents]")
-        for k in self.ped_map:
-            s, d = self.ped_map[k]
-            if s not in map_s2i:  # new
-                map_s2i[s] = 1
-                self.mapID2Gender[s] = "M"
-            else:
-                map_s2i[s] += 1
+    def __load_record(self, code, c_s, c_d):
+        """
+        Store one record of codes, code being non-missing. Self-parents and duplicates go to self.diag
+        """
+        if code == c_s or code == c_d:
+            self.diag.add('self_parent', (code,))
+            if code == c_s:
+                c_s = 0
+            if code == c_d:
+                c_d = 0
 
-            if d not in map_d2i:  # new
-                map_d2i[d] = 1
-                self.mapID2Gender[d] = "F"
-            else:
-                map_d2i[d] += 1
-
-        # make sure the two sets excludes each other
-        # inserting intersection of Sire and Dam
-        # print out the intersection and its count to support what gender it was
-        intersection = set(map_s2i.keys()).intersection(map_d2i.keys())
-        if len(intersection):  # consider self.missing_out
-            for idx in intersection:
+        if not self.has_rec[code]:            # new entry
+            self.has_rec[code] = 1
+            self.n_rec += 1
+            self.sire[code] = c_s
+            self.dam[code] = c_d
+        # duplicated but same record, just return: no-missing stored first
+        # 20150729: partly canceled. overriding using new entry
+        elif self.sire[code] == c_s and self.dam[code] == c_d:  # same
+            self.diag.add('duplicate_same', (code,))
+
+        # 20150612: override empty entry
+        # 20150729: canceled. overriding using new entry
+        else:
+            self.diag.add('duplicate_diff', (code, self.sire[code], self.dam[code], c_s, c_d))
+            self.sire[code] = c_s
+            self.dam[code] = c_d
+
+    # 20261018: incremental updates, instead of reloading the whole pedigree
+    def apply_delta(self, file_name):
+        """
+        Apply a delta file to the loaded or cached pedigree. Delta file: whitespace delimited, one change per
+        line, lines starting with sharp ignored
+            + ID SIRE DAM [BIRTH]   new record, or correction of the record of ID; a birth date replaces the
+                                    one known
+            - ID                    deletion of the record of ID, still known as a parent
+        IDs go through missing_in and the xref maps as in load_ped(). Changes are applied in order.
+        The offspring index is dropped, check(codes) re-validates what changed.
+        :param file_name: delta file
+        :return: list of the codes to re-validate: changed records, their old and new parents; None on error
+        """
+        if not file_exists(file_name):
+            self.l.error(" * Delta file {} could not be open to read.".format(file_name))
+            return None
+        ops = []
+        with open_file(file_name, 'r') as fp:
+            for line in fp:
+                vec_tmp = line.split()
+                if not vec_tmp or vec_tmp[0][0] == "#":  # ignore empty or comment lines
+                    continue
+                if (vec_tmp[0], len(vec_tmp)) not in (('+', 4), ('+', 5), ('-', 2)) or \
+                        _parse_births(vec_tmp[4:], (self.missing_in,))[1]:
+                    self.l.error("PedMap::apply_delta() ERROR - delta file {}: '+ ID SIRE DAM [BIRTH]' or '- ID'"
+                                 " expected, line [{}]".format(file_name, line.rstrip("\n")))
+                    return None
+                ops.append(vec_tmp)
+
+        with self.stats.stage('delta'):
+            if self.cnt_s is None:
+                self.__count_parents()
+            self.diag = PedDiagnostics(self.diag_sample)
+            cnt_s = self.cnt_s
+            cnt_d = self.cnt_d
+            touched = OrderedDict()     # codes to re-validate, in order
+            n_new = n_fix = n_del = 0
+            for vec_tmp in ops:
+                born = 0
+                if vec_tmp[0] == '+':
+                    fields = vec_tmp[1:4]
+                    self.__map_fields(fields)
+                    idx, sire, dam = fields
+                    born = _parse_births(vec_tmp[4:])[0]
+                    born = born[0] if born else 0
+                    if born:
+                        self.__use_birth()
+                else:
+                    idx = vec_tmp[1] if vec_tmp[1] != self.missing_in else self.missing_out
+                    idx = self.mapXrefA.get(idx, idx)
+                    sire = dam = self.missing_out
                 if idx == self.missing_out:
                     continue
-                self.l.warning("  * B Error: IDs appeared in both sire and dam columns. Use 'xref.CorrectB'" +
-                               " as a xref file for the next run.")
-                self.l.warning("    - creating 'xref.CorrectB'")
+                code = self.__intern(idx)
+                c_s = self.__intern(sire)
+                c_d = self.__intern(dam)
+                n_code = len(self.id_list)
+                if len(cnt_s) < n_code:
+                    self.cnt_s = cnt_s = self.__grow(cnt_s, n_code)
+                    self.cnt_d = cnt_d = self.__grow(cnt_d, n_code)
+                has_rec = self.has_rec      # may be new arrays in disk mode
+                ped_s = self.sire
+                ped_d = self.dam
+                if code == c_s or code == c_d:
+                    self.diag.add('self_parent', (code,))
+                    c_s = 0 if code == c_s else c_s
+                    c_d = 0 if code == c_d else c_d
+                old_s = ped_s[code]
+                old_d = ped_d[code]
+                had_rec = has_rec[code]
+                if born and self.birth[code] != born:
+                    self.birth[code] = born
+                    touched[code] = None
+                if vec_tmp[0] == '-':
+                    if not had_rec:
+                        self.l.warning("  # delta: no record of {} to delete, ignored".format(idx))
+                        continue
+                    if self.birth is not None:
+                        self.birth[code] = 0
+                    has_rec[code] = 0
+                    self.n_rec -= 1
+                    n_del += 1
+                elif not had_rec:
+                    has_rec[code] = 1
+                    self.n_rec += 1
+                    n_new += 1
+                elif old_s == c_s and old_d == c_d:
+                    continue
+                else:
+                    n_fix += 1
+                if had_rec:
+                    cnt_s[old_s] -= 1
+                    cnt_d[old_d] -= 1
+                if has_rec[code]:
+                    cnt_s[c_s] += 1
+                    cnt_d[c_d] += 1
+                ped_s[code] = c_s
+                ped_d[code] = c_d
+                touched.update(dict.fromkeys((code, old_s, old_d, c_s, c_d)))
+            self.__trim()
+        self.off_ptr = None
+        self.off_lst = None
+        self.batch_order = None
+        self.memo.clear()
+        self.diag.report(self.l, self.id_list)
+        touched.pop(0, None)
+        self.l.debug("delta {}: {} new, {} corrected, {} deleted records".format(file_name, n_new, n_fix, n_del))
+        self.stats.counts['records'] = self.n_rec
+        self.stats.count('delta_new', n_new)
+        self.stats.count('delta_corrected', n_fix)
+        self.stats.count('delta_deleted', n_del)
+        return list(touched)
+
+    def apply_xref(self, file_name):
+        """
+        Apply a xref file to the loaded or cached pedigree, without reading the pedigree again. The rules are
+        compiled as by load_xref_map(), the sire and dam columns translated in bulk and the record of a renamed
+        ID moved to its new ID. Records ending up on the same ID are duplicates, resolved as by load_ped(), the
+        last one replacing the others, in code order: the order their IDs were first read in. The xref maps
+        become the loaded ones followed by this one, for the next apply_delta().
+        The offspring index is dropped, check(codes) re-validates what changed.
+        :param file_name: xref file
+        :return: list of the codes to re-validate: renamed IDs, their new IDs, changed records and their old and
+                 new parents; None on error
+        """
+        with self.stats.stage('xref'):
+            xref = self.__read_xref(file_name)
+            if xref is None:
+                self.l.error(" * Xref file {} could not be open to read.".format(file_name))
+                return None
+            tabs, _ = xref
+            self.diag = PedDiagnostics(self.diag_sample)
+            trs = []            # per column, code -> code
+            for tab in tabs:
+                tr = {}
+                for src, dst in tab.items():
+                    code = self.id2code.get(src)
+                    if code:        # known, not missing
+                        tr[code] = self.__intern(dst)
+                trs.append(tr)
+            tr_i, tr_s, tr_d = trs
+            n_code = len(self.id_list)
+            has_rec = self.has_rec      # may be new arrays in disk mode
+            ped_s = self.sire
+            ped_d = self.dam
+            touched = OrderedDict()     # codes to re-validate, in order
+            n_hit = 0
+            for ped, tr in ((ped_s, tr_s), (ped_d, tr_d)):
+                if not tr:
+                    continue
+                for code in compress(range(n_code), map(tr.__contains__, ped)):
+                    old = ped[code]
+                    new = tr[old]
+                    if new == code:
+                        self.diag.add('self_parent', (code,))
+                        new = 0
+                    ped[code] = new
+                    touched.update(dict.fromkeys((code, old, new)))
+                    n_hit += 1
+
+            birth = self.birth
+            moved = OrderedDict()   # new ID -> records renamed onto it, (code, sire, dam, birth)
+            for code, dst in tr_i.items():
+                if not has_rec[code]:
+                    continue
+                born = 0
+                if birth is not None:
+                    born = birth[code]
+                    birth[code] = 0
+                moved.setdefault(dst, []).append((code, ped_s[code], ped_d[code], born))
+                touched.update(dict.fromkeys((code, dst, ped_s[code], ped_d[code])))
+                has_rec[code] = 0
+                ped_s[code] = ped_d[code] = 0
+                self.n_rec -= 1
+                n_hit += 1
+            n_del = len(moved.pop(0, ()))
+            n_moved = sum(map(len, moved.values()))
+            # 20261018: through __load_record() in code order, for the duplicates and self-parents of the loader
+            load_record = self.__load_record
+            for dst, recs in moved.items():
+                if has_rec[dst]:
+                    recs.append((dst, ped_s[dst], ped_d[dst], birth[dst] if birth is not None else 0))
+                    has_rec[dst] = 0
+                    self.n_rec -= 1
+                recs.sort()
+                for code, c_s, c_d, born in recs:
+                    load_record(dst, c_s, c_d)
+                    if born:
+                        birth[dst] = born
+            self.__trim()
+            self.__count_parents()
+            self.mapXrefA, self.mapXrefS, self.mapXrefD = _compose_xref((self.mapXrefA, self.mapXrefS,
+                                                                         self.mapXrefD), tabs)
+        self.off_ptr = None
+        self.off_lst = None
+        self.batch_order = None
+        self.memo.clear()
+        self.diag.report(self.l, self.id_list)
+        touched.pop(0, None)
+        self.l.debug("xref {}: {} fields changed, {} records renamed, {} deleted"
+                     .format(file_name, n_hit, n_moved, n_del))
+        self.stats.counts['records'] = self.n_rec
+        self.stats.count('xref_hits', n_hit)
+        return list(touched)
+
+    def check(self, codes=None, report_fn=None):
+        """
+        Check the loaded pedigree in a few bulk passes over the code arrays: IDs used as both sire and dam,
+        parents without a record, parents born after their offspring if birth dates were loaded, and pedigree
+        loops. Corrections are written once into xref.CorrectB and xref.CorrectL, and the totals logged with
+        a sample of each issue. Birth dates are not kept in the pedigree cache.
+        :param codes: re-validate only these codes, as returned by apply_delta(), instead of the whole pedigree
+        :param report_fn: file to append every issue found to, only a sample of them is logged
+        :return: bool, True if no error was found: parents without a record or born after their offspring
+                 are warnings only
+        """
+        if report_fn == 'None':
+            report_fn = None
+        if codes is not None:
+            return self.__check_codes(codes, report_fn)
+        with self.stats.stage('check'):
+            ret = True
+            if not self.isValid:
+                self.l.warning("  * Errors occurred while reading pedigree.")
+                ret = False
+
+            n_code = len(self.id_list)
+            has_rec = self.has_rec
+            self.__count_parents()
+            cnt_s = self.cnt_s
+            cnt_d = self.cnt_d
+            self.mapID2Gender = gender = self.__code_array('B', n_code)
+            for code in compress(range(n_code), cnt_d):
+                gender[code] = ord('F')
+            for code in compress(range(n_code), cnt_s):
+                gender[code] = ord('M')
+            gender[0] = 0
+            conflicts = [code for code in compress(range(n_code), map(operator.mul, cnt_s, cnt_d)) if code]
+            self.conflict_list = conflicts
+
+            born_after = []
+            birth = self.birth
+            if birth is not None:   # unknown dates are 0, never after another
+                for ped in (self.sire, self.dam):
+                    for code in compress(range(n_code), map(operator.gt, map(birth.__getitem__, ped), birth)):
+                        if birth[code]:
+                            born_after.append((code, ped[code], birth[code], birth[ped[code]]))
+                born_after.sort()
+
+            # 20261018: every pedigree loop, in one pass. A loop has a link from an ID to a parent of a larger
+            #           code, parents being mostly coded before their offspring the search starts from those IDs,
+            #           streamed in order (an ID of two such links twice) rather than kept
+            def back_links(ped):
+                return (code for code in compress(range(n_code), map(operator.gt, ped, range(n_code)))
+                        if has_rec[ped[code]])
+            n_back = sum(1 for ped in (self.sire, self.dam) for _ in back_links(ped))
+            roots = heapq.merge(back_links(self.sire), back_links(self.dam)) if n_back < self.n_rec // 2 else None
+            self.loop_list = self.__find_loops(roots)
+
+            if not self.__report_check(conflicts, born_after, report_fn):
                 ret = False
+        return ret
+
+    def __check_codes(self, codes, report_fn=None):
+        """
+        check() of the codes changed by apply_delta(): their sex from the parent counts, their birth dates
+        against their parents', and the loops through them. A new loop has to go through a changed record, and
+        only IDs being parents can be on one. The sex conflicts and loops of the other IDs are kept.
+        """
+        with self.stats.stage('check'):
+            cnt_s = self.cnt_s
+            cnt_d = self.cnt_d
+            gender = self.mapID2Gender
+            has_rec = self.has_rec
+            for code in codes:
+                gender[code] = ord('M') if cnt_s[code] else ord('F') if cnt_d[code] else 0
+            changed = set(codes)
+            conflicts = [code for code in self.conflict_list if code not in changed]
+            conflicts.extend(code for code in codes if cnt_s[code] and cnt_d[code])
+            self.conflict_list = conflicts
+
+            born_after = []
+            birth = self.birth
+            if birth is not None:
+                for code in codes:
+                    if has_rec[code] and birth[code]:
+                        for parent in (self.sire[code], self.dam[code]):
+                            if birth[parent] > birth[code]:
+                                born_after.append((code, parent, birth[code], birth[parent]))
+
+            loops = [loop for loop in self.loop_list if changed.isdisjoint(loop)]
+            known = {min(loop) for loop in loops}
+            roots = [code for code in codes if has_rec[code] and (cnt_s[code] or cnt_d[code])]
+            loops.extend(loop for loop in self.__find_loops(roots) if min(loop) not in known)
+            self.loop_list = loops
+            ret = self.__report_check(conflicts, born_after, report_fn, codes)
+        self.l.debug("{} IDs re-checked".format(len(codes)))
+        return ret
+
+    def __report_check(self, conflicts, born_after, report_fn=None, codes=None):
+        """
+        Report what check() found, once: xref.CorrectB for the sex conflicts, the totals and a sample of the sex
+        conflicts, parents without a record and parents born after their offspring, xref.CorrectL for the loops,
+        and the counts
+        :param conflicts: codes used as both sire and dam
+        :param born_after: (code, parent, birth, parent's birth) of the parents born after their offspring
+        :param report_fn: file to append every issue to
+        :param codes: the codes re-checked by check(codes); the rules of xref.CorrectB for other IDs are kept
+        :return: bool, False if there is a sex conflict or a loop
+        """
+        ret = True
+        cnt_s = self.cnt_s
+        cnt_d = self.cnt_d
+        lines = []
+        for code in conflicts:     # the column it is in less often is corrected
+            s_op = "A" if cnt_s[code] == cnt_d[code] else "D" if cnt_s[code] > cnt_d[code] else "S"
+            lines.append("{} {} {}\n".format(s_op, self.id_list[code], self.missing_out))
+        if conflicts:
+            self.l.warning("  * B Error: {} IDs appeared in both sire and dam columns. Use 'xref.CorrectB'"
+                           " as a xref file for the next run.".format(len(conflicts)))
+            ret = False
+        if codes is not None and os.path.exists('xref.CorrectB'):
+            # merged: the rules of the IDs re-checked and of the conflicts are replaced, the others kept
+            checked = {self.id_list[code] for code in chain(codes, conflicts)}
+            with open('xref.CorrectB', 'r') as fp:
+                old = fp.readlines()
+            kept = [line for line in old if len(line.split()) < 2 or line.split()[1] not in checked]
+            if lines or len(kept) < len(old):
+                self.l.warning("    - updating 'xref.CorrectB'")
                 with open('xref.CorrectB', 'w') as fp:
-                    for idd in intersection:
-                        if idd == self.missing_out:
-                            continue
-                        cnt_s = map_s2i[idd]
-                        cnt_d = map_d2i[idd]
-                        if cnt_s == cnt_d:
-                            s_op = "A"
-                        elif cnt_s > cnt_d:    # sire more, change dam
-                            s_op = "D"
-                        else:
-                            s_op = "S"         # dam more, change sire
+                    fp.writelines(kept + lines)
+        elif conflicts:
+            self.l.warning("    - creating 'xref.CorrectB'")
+            with open('xref.CorrectB', 'w') as fp:
+                fp.writelines(lines)
+
+        # parents without a record: set in mapID2Gender, streamed in bulk
+        is_parent = bytes(self.mapID2Gender).translate(_IS_SET)
+        no_rec = zip(compress(range(1, len(self.id_list)),
+                              map(operator.gt, islice(is_parent, 1, None), islice(self.has_rec, 1, None))))
+        diag = PedDiagnostics(self.diag_sample, keep_all=report_fn is not None)
+        diag.extend('sex_conflict', [(code, cnt_s[code], cnt_d[code]) for code in conflicts])
+        diag.extend('no_record', no_rec)
+        n_no_rec = diag.counts.get('no_record', 0)
+        diag.extend('born_after', born_after)
+        diag.report(self.l, self.id_list, file_name=report_fn, mode='a')
+        if not self.__report_loops():
+            ret = False
 
-                        s_op = "{} {} {}\n".format(s_op, idd, self.missing_out)
-                        fp.write(s_op)
+        counts = self.stats.counts
+        counts['missing_sire'] = cnt_s[0]
+        counts['missing_dam'] = cnt_d[0]
+        counts['parents_without_record'] = n_no_rec
+        counts['sex_conflicts'] = len(conflicts)
+        if self.birth is not None:
+            counts['born_after_offspring'] = len(born_after)
+        counts['loops'] = len(self.loop_list)
+        self.l.debug("check: {} records, {} sex conflicts, {} parents without a record, {} parents born after"
+                     " their offspring, {} loops".format(self.n_rec, len(conflicts), n_no_rec, len(born_after),
+                                                         len(self.loop_list)))
         return ret
 
+    def __count_parents(self):
+        """
+        self.cnt_s and self.cnt_d, the number of records having each code as sire and as dam; counted in bulk,
+        a block of codes at a time, small enough for the Counter of a block of distinct parents
+        """
+        n_code = len(self.id_list)
+        has_rec = self.has_rec
+        self.cnt_s = self.__code_array('i', n_code)
+        self.cnt_d = self.__code_array('i', n_code)
+        step = 1 << 16
+        for cnt, ped in ((self.cnt_s, self.sire), (self.cnt_d, self.dam)):
+            for lo in range(0, n_code, step):
+                for code, n in Counter(compress(ped[lo:lo + step], has_rec[lo:lo + step])).items():
+                    cnt[code] += n
+
+    def __report_loops(self):
+        """
+        Log self.loop_list and write xref.CorrectL breaking them
+        :return: bool, True if there is no loop
+        """
+        if not self.loop_list:
+            return True
+        self.l.warning("  * L Error: {} pedigree loop(s) detected. Use 'xref.CorrectL' as a xref file"
+                       " for the next run."
+                       .format(len(self.loop_list)))
+        for i, loop in enumerate(self.loop_list):
+            self.l.warning("    - loop {}, {} IDs: {}".format(i + 1, len(loop),
+                                                              " ".join(self.id_list[x] for x in loop)))
+        self.l.warning("    - creating 'xref.CorrectL'")
+        self.__write_xref_loops('xref.CorrectL')
+        return False
+
+    def __find_loops(self, roots=None):
+        """
+        Find all the pedigree loops, as the strongly connected components (Tarjan, non recursive) of
+        the ID -> parent graph having more than one ID. Self-parents are removed while loading.
+        :param roots: codes to start from, only the loops among their ancestors are found; None for all
+        :return: list of loops, each a list of codes
+        """
+        n_code = len(self.id_list)
+        ped_s = self.sire
+        ped_d = self.dam
+        if roots is None:
+            index = self.__code_array('i', n_code)   # visiting order, from 1; 0 if not visited yet
+            low = self.__code_array('i', n_code)
+            on_stack = self.__code_array('B', n_code)
+        else:   # 20261018: sized to the ancestors walked, a Counter reading 0 for the IDs not visited yet
+            index = Counter()
+            low = {}
+            on_stack = Counter()
+        stack = []
+        counter = 0
+        loops = []
+        for root in (range(1, n_code) if roots is None else roots):
+            if index[root] or not self.has_rec[root]:
+                continue
+            counter += 1
+            index[root] = low[root] = counter
+            stack.append(root)
+            on_stack[root] = 1
+            td_lst = [root]     # call stack
+            td_pos = [0]        # next parent to look at: 0 sire, 1 dam, 2 done
+            while td_lst:
+                v = td_lst[-1]
+                k = td_pos[-1]
+                if k < 2:
+                    td_pos[-1] = k + 1
+                    w = ped_d[v] if k else ped_s[v]
+                    if not w:
+                        continue
+                    if not index[w]:
+                        counter += 1
+                        index[w] = low[w] = counter
+                        stack.append(w)
+                        on_stack[w] = 1
+                        td_lst.append(w)
+                        td_pos.append(0)
+                    elif on_stack[w] and index[w] < low[v]:
+                        low[v] = index[w]
+                    continue
+
+                td_lst.pop()
+                td_pos.pop()
+                if td_lst and low[v] < low[td_lst[-1]]:
+                    low[td_lst[-1]] = low[v]
+                if low[v] == index[v]:
+                    loop = []
+                    while True:
+                        w = stack.pop()
+                        on_stack[w] = 0
+                        loop.append(w)
+                        if w == v:
+                            break
+                    if len(loop) > 1:
+                        loops.append(loop[::-1])
+        return loops
+
+    def __write_xref_loops(self, file_name):
+        """
+        Write a xref file breaking every loop in self.loop_list. A rule 'S ID .' or 'D ID .' drops the links to
+        ID from all its offspring in that column, so the links cut are picked greedily: a cycle of the loop is
+        found, its link to the parent with the fewest offspring in that column is cut, and so on until the loop
+        has no cycle left.
+        :param file_name: output xref file name
+        :return: number of parent links dropped by the rules
+        """
+        lines = []
+        n_drop = 0
+        for loop in self.loop_list:
+            cut = set()     # (0 sire or 1 dam, parent code)
+            done = set()    # IDs on no cycle, once the links in cut are dropped
+            while True:
+                cycle = self.__find_cycle(loop, cut, done)
+                if cycle is None:
+                    break
+                k, w = min(cycle, key=lambda link: (self.cnt_d if link[0] else self.cnt_s)[link[1]])
+                cut.add((k, w))
+                n_drop += (self.cnt_d if k else self.cnt_s)[w]
+                lines.append("{} {} {}\n".format("D" if k else "S", self.id_list[w], self.missing_out))
+
+        with open(file_name, 'w') as fp:
+            for i, loop in enumerate(self.loop_list):
+                fp.write("# loop {}: {}\n".format(i + 1, " ".join(self.id_list[x] for x in loop)))
+            fp.writelines(lines)
+        self.l.debug("{}: {} rules, {} parent links dropped".format(file_name, len(lines), n_drop))
+        return n_drop
+
+    def __find_cycle(self, loop, cut, done):
+        """
+        Depth-first walk inside a loop for a cycle, the links in cut being dropped
+        :param loop: codes of the loop
+        :param cut: (0 sire or 1 dam, parent code) of the links dropped
+        :param done: IDs known to be on no cycle, updated
+        :return: list of the links of a cycle, (0 sire or 1 dam, parent code) each; None if there is none
+        """
+        members = set(loop)
+        for root in loop:
+            if root in done:
+                continue
+            td_lst = [root]
+            td_pos = [0]    # next parent to look at: 0 sire, 1 dam, 2 done
+            on_path = {root}
+            while td_lst:
+                v = td_lst[-1]
+                k = td_pos[-1]
+                if k < 2:
+                    td_pos[-1] = k + 1
+                    w = self.dam[v] if k else self.sire[v]
+                    if w not in members or w in done or (k, w) in cut:
+                        continue
+                    if w in on_path:    # v -> w closes a cycle
+                        i = td_lst.index(w)
+                        return [(td_pos[j] - 1, td_lst[j + 1]) for j in range(i, len(td_lst) - 1)] + [(k, w)]
+                    td_lst.append(w)
+                    td_pos.append(0)
+                    on_path.add(w)
+                    continue
+                td_lst.pop()
+                td_pos.pop()
+                on_path.discard(v)
+                done.add(v)
+        return None
+
+    def build_offspring_index(self):
+        """
+        Build the parent -> offspring index in CSR form: off_ptr (offsets, one per code plus one)
+        and off_lst (flat array of offspring codes), in two passes over sire/dam
+        """
+        n_code = len(self.id_list)
+        ped_s = self.sire
+        ped_d = self.dam
+        cnt = array('i', [0]) * (n_code + 1)
+        for code in range(1, n_code):
+            cnt[ped_s[code] + 1] += 1
+            cnt[ped_d[code] + 1] += 1
+        cnt[1] = 0                      # missing parent, code 0, has no offspring
+        self.off_ptr = array('i', accumulate(cnt))
+        pos = array('i', self.off_ptr)
+        off_lst = array('i', [0]) * self.off_ptr[n_code]
+        for code in range(1, n_code):
+            s = ped_s[code]
+            if s:
+                off_lst[pos[s]] = code
+                pos[s] += 1
+            d = ped_d[code]
+            if d:
+                off_lst[pos[d]] = code
+                pos[d] += 1
+        self.off_lst = off_lst
+        self.l.debug("offspring index built, {} parent links".format(len(off_lst)))
+
     def get_offspring_set(self, idx):
         ret = set()
-        if idx in self.mapID2SetOffspring:
-            ret = self.mapID2SetOffspring[idx]
+        code = self.get_code(idx)
+        if code:
+            if self.off_ptr is None:
+                self.build_offspring_index()
+            if code + 1 < len(self.off_ptr):    # else interned after the index was built, no offspring
+                ret = {self.id_list[x] for x in self.off_lst[self.off_ptr[code]:self.off_ptr[code + 1]]}
+        return ret
+
+    def get_descendant_codes(self, codes, rec_gen_max=0):
+        """
+        Breadth-first, generation by generation, from all the codes at once
+        :param codes: codes of the listed IDs, at generation 1
+        :param rec_gen_max: their offspring are generation 2, etc. 0 for no limit
+        :return: list of the descendant codes, by generation
+        """
+        if self.off_ptr is None:
+            self.build_offspring_index()
+        off_ptr = self.off_ptr
+        off_lst = self.off_lst
+        n_idx = len(off_ptr) - 1    # codes interned after the index was built have no offspring
+        expanded = set()            # sized to the walk, not to the pedigree
+        emitted = set()
+        ret = []
+        frontier = []
+        for code in codes:
+            if 0 < code < n_idx and code not in expanded:
+                expanded.add(code)
+                frontier.append(code)
+        cur_gen = 1
+        while frontier and (rec_gen_max == 0 or cur_gen < rec_gen_max):
+            nxt = []
+            for code in frontier:
+                for child in off_lst[off_ptr[code]:off_ptr[code + 1]]:
+                    if child not in emitted:
+                        emitted.add(child)
+                        ret.append(child)
+                    if child not in expanded:
+                        expanded.add(child)
+                        nxt.append(child)
+            frontier = nxt
+            cur_gen += 1
+        return ret
+
+    # 20261018: in-process queries, memoized per animal
+    def get_ancestors(self, ids, gen_max=0):
+        """
+        :param ids: IDs, unknown ones ignored
+        :param gen_max: generations up, 1 for the parents; 0 for all
+        :return: list of the ancestors of any of ids, by code. A listed ID is there only as an ancestor of another.
+        """
+        return self.__query('a', ids, gen_max)
+
+    def get_descendants(self, ids, gen_max=0):
+        """
+        :param gen_max: generations down, 1 for the offspring; 0 for all
+        :return: list of the descendants of any of ids, by code
+        """
+        return self.__query('d', ids, gen_max)
+
+    def get_relatives(self, ids, gen_max=0):
+        """
+        :param gen_max: parent-offspring links away, 1 for parents and offspring, 2 adding grandparents, sibs,
+                        grand-offspring and mates; 0 for all
+        :return: list of the IDs linked to any of ids by up to gen_max parent-offspring links, by code
+        """
+        return self.__query('r', ids, gen_max)
+
+    def __query(self, kind, ids, gen_max):
+        gen_max = max(int(gen_max), 0)
+        if kind != 'a' and self.off_ptr is None:
+            self.build_offspring_index()
+        codes = [code for code in map(self.get_code, ids) if code]
+        if len(codes) == 1:
+            ret = self.__closure(kind, codes[0], gen_max)
+        else:
+            ret = set()
+            for code in dict.fromkeys(codes):
+                ret.update(self.__closure(kind, code, gen_max))
+        ids = self.id_list
+        return [ids[code] for code in sorted(ret)]
+
+    def __closure(self, kind, code, gen_max):
+        """
+        Codes reached from code by up to gen_max steps (0 for no limit), to its parents for kind 'a', to its
+        offspring for 'd', to both for 'r'; from self.memo if there. Without a limit, an ancestor or descendant
+        already in self.memo adds its own closure instead of being walked again.
+        :return: array('i') of codes, code itself excluded
+        """
+        key = (kind, code, gen_max)
+        ret = self.memo.get(key)
+        if ret is not None:
+            return ret
+        ped_s = self.sire
+        ped_d = self.dam
+        off_ptr = self.off_ptr
+        off_lst = self.off_lst
+        n_idx = len(off_ptr) - 1 if off_ptr is not None else 0    # codes interned later have no offspring
+        memo_get = self.memo.get if gen_max == 0 and kind != 'r' else None
+        found = {code}
+        frontier = [code]
+        n_gen = 0
+        while frontier and (gen_max == 0 or n_gen < gen_max):
+            n_gen += 1
+            next_gen = []
+            for c in frontier:
+                if kind == 'a':
+                    nbrs = (ped_s[c], ped_d[c])
+                elif kind == 'd':
+                    nbrs = off_lst[off_ptr[c]:off_ptr[c + 1]] if c < n_idx else ()
+                else:
+                    nbrs = (ped_s[c], ped_d[c]) + (tuple(off_lst[off_ptr[c]:off_ptr[c + 1]]) if c < n_idx else ())
+                for x in nbrs:
+                    if x and x not in found:
+                        found.add(x)
+                        sub = memo_get((kind, x, 0)) if memo_get is not None else None
+                        if sub is not None:
+                            found.update(sub)
+                        else:
+                            next_gen.append(x)
+            frontier = next_gen
+        found.discard(code)
+        ret = array('i', found)
+        self.memo.put(key, ret)
         return ret
 
     # 20160331: a regular pedRefiner job
-    def refine(self, list_file_name, opt_file_name, rec_gen_max=0, sep_out=",", flag_r=False):
-        if os.path.exists(list_file_name):
-            with open(list_file_name, 'r') as fp:
+    def refine(self, list_file_name, opt_file_name, rec_gen_max=0, sep_out=",", flag_r=False, map_file_name=None,
+               inbreeding=0, prune=0):
+        """
+        :param list_file_name: listed IDs, one per line
+        :param opt_file_name: output pedigree, or descendant IDs if flag_r
+        :param rec_gen_max: maximum generation, 0 for no limit
+        :param sep_out: field separator
+        :param flag_r: output descendant IDs, one per line, up to rec_gen_max generations
+        :param map_file_name: if given, the output pedigree is renumbered, see __write_renum_ped()
+        :param inbreeding: 1 to add the inbreeding coefficient of each output ID as a column, 2 to add its
+                           generation depth too; computed on the output pedigree
+        :param prune: if > 1, uninformative ancestors are dropped from the output, see __prune_opt_set()
+        :return: bool, True if success
+        """
+        if file_exists(list_file_name):
+            with open_file(list_file_name, 'r') as fp:
                 anm_list = fp.read().splitlines()
 
             self.l.debug("{} individuals marked for populating result ped".format(len(anm_list)))
-            self.__populate_opt_map(anm_list, rec_gen_max)  # filling result set: opt_map
-
-            if self.stem_fault:
-                self.l.error("  * L Pedigree loop detected while filling result set, stem = {}".format(self.stem))
-                self.isValid = False
-            else:
+            if flag_r:
+                # 20261018: -r, descendant IDs instead of the refined pedigree
+                codes = [self.get_code(idx.strip()) for idx in anm_list]
+                with self.stats.stage('descendants'):
+                    desc = self.get_descendant_codes(codes, rec_gen_max)
                 self.isValid = True
-                self.l.debug("writing output")
-                with open(opt_file_name, 'w') as fp:
-                    for idx in self.opt_set:    # self.opt_vec:
-                        fp.write("{0}{2}{1[0]}{2}{1[1]}\n".format(idx, self.opt_map[idx], sep_out))
+                self.l.debug("writing {} descendants".format(len(desc)))
+                ids = self.id_list
+                self.__write_blocks(opt_file_name, (desc, lambda part: "".join([ids[code] + "\n" for code in part])))
+                self.stats.count('output_records', len(desc))
+            else:
+                self.__populate_opt_map(anm_list, rec_gen_max)  # filling result set: opt_map
+
+                if self.stem_fault:
+                    self.l.error("  * L Pedigree loop detected while filling result set, stem = {}".format(self.stem))
+                    self.isValid = False
+                else:
+                    self.isValid = True
+                    if int(prune) > 1:
+                        self.__prune_opt_set(anm_list, int(prune))
+                    cols = ()
+                    if inbreeding:
+                        f, depth = self.get_inbreeding(self.opt_set, int(inbreeding) > 1)
+                        cols = (("{:.6f}", f),) + ((("{}", depth),) if depth is not None else ())
+                    self.l.debug("writing output")
+                    if map_file_name:
+                        self.__write_renum_ped(opt_file_name, map_file_name, self.opt_set, sep_out, cols)
+                    else:
+                        self.__write_opt_ped(opt_file_name, self.opt_set, sep_out, cols)
         else:
             self.l.error(" * AnimalID list file {} could not be open to read.".format(list_file_name))
             self.isValid = False
@@ -251,6 +2483,349 @@ class PedRefiner:
         self.l.debug("refine() is returning [{}]".format(self.isValid))
         return self.isValid
 
+    def query_refine(self, anm_list, rec_gen_max=0, prune=0, unknown=None):
+        """
+        refine() without files. The pedigree is left as it is: listed IDs not in it are not interned
+        :param anm_list: IDs
+        :param rec_gen_max: as in refine()
+        :param prune: as in refine()
+        :param unknown: list receiving the listed IDs not in the pedigree, to be output as they are, with missing
+                        parents
+        :return: list of (code, sire code, dam code), parents before offspring; None on a pedigree loop
+        """
+        self.__populate_opt_map(anm_list, rec_gen_max, [] if unknown is None else unknown)
+        if self.stem_fault:
+            self.l.error("  * L Pedigree loop detected while filling result set, stem = {}".format(self.stem))
+            return None
+        if int(prune) > 1:
+            self.__prune_opt_set(anm_list, int(prune))
+        return [(code,) + self.get_opt_parents(code) for code in self.opt_set]
+
+    def __write_opt_ped(self, opt_file_name, codes, sep_out=",", cols=()):
+        """
+        :param opt_file_name: output pedigree file
+        :param codes: codes of self.opt_map, sorted
+        :param sep_out: field separator
+        :param cols: extra columns, (format, values by row) each
+        """
+        if not cols:
+            self.__write_blocks(opt_file_name, (codes, self.__fmt_opt_rows(sep_out)))
+        else:
+            codes = list(codes)
+            ids = self.id_list
+            get_opt_parents = self.get_opt_parents
+            line = sep_out.join(["{}"] * 3 + [fmt for fmt, _ in cols]) + "\n"
+            values = [vals for _, vals in cols]
+
+            def fmt_block(part):
+                sub = codes[part.start:part.stop]
+                return "".join([line.format(ids[code], ids[s], ids[d], *[v[k] for v in values])
+                                for k, code, (s, d) in zip(part, sub, map(get_opt_parents, sub))])
+            self.__write_blocks(opt_file_name, (range(len(codes)), fmt_block))
+        self.stats.count('output_records', len(codes))
+
+    def __renumber(self, codes):
+        """
+        :param codes: codes of self.opt_map, sorted
+        :return: (sires, dams), array('i') of the parent numbers in the output pedigree by number 1..n, 0 for
+                 missing; item 0 unused
+        """
+        num = array('i', [0]) * len(self.id_list)     # code -> number, 0 for missing
+        for k, code in enumerate(codes, 1):
+            num[code] = k
+        if self.rec_gen_max > 0:
+            sires, dams = zip(*map(self.get_opt_parents, codes)) if codes else ((), ())
+        else:
+            sires = map(self.sire.__getitem__, codes)
+            dams = map(self.dam.__getitem__, codes)
+        return array('i', [0]) + array('i', map(num.__getitem__, sires)), \
+            array('i', [0]) + array('i', map(num.__getitem__, dams))
+
+    # 20261018: on the sorted output, parents before offspring
+    def get_inbreeding(self, codes, with_depth=False):
+        """
+        Inbreeding coefficients of the output pedigree, see _inbreeding(), parents cut at rec_gen_max as
+        written out
+        :param codes: codes of self.opt_map, sorted
+        :param with_depth: also return the generation depths
+        :return: (array('d') of F, array('i') of generation depths or None), by row
+        """
+        codes = list(codes)
+        with self.stats.stage('inbreeding'):
+            sires, dams = self.__renumber(codes)
+            f = _inbreeding(sires, dams)[1:]
+            depth = _gen_depth(sires, dams)[1:] if with_depth else None
+        self.stats.count('inbred', sum(1 for x in f if x > 0.))
+        return f, depth
+
+    # 20261018: input of BLUP solvers, without renumbering it again
+    def __write_renum_ped(self, opt_file_name, map_file_name, codes, sep_out=",", cols=()):
+        """
+        Write the output pedigree renumbered 1..n in output order, missing parents as 0, and the number -> ID map
+        :param opt_file_name: "n,sire,dam" lines; or, ending with .npy, an int32 array of shape (n, 3), extra
+                              columns going into BASE.COL_NUMBER.npy
+        :param map_file_name: "n,ID" lines
+        :param codes: codes of self.opt_map, sorted
+        :param sep_out: field separator
+        :param cols: extra columns, (format, values by row) each
+        """
+        codes = list(codes)
+        n_row = len(codes)
+        sires, dams = self.__renumber(codes)
+        rows = array('i', [0]) * (3 * n_row)
+        rows[0::3] = array('i', range(1, n_row + 1))
+        rows[1::3] = sires[1:]
+        rows[2::3] = dams[1:]
+        del sires, dams
+
+        if opt_file_name.lower().endswith('.npy'):
+            with self.stats.stage('write'):
+                save_npy(opt_file_name, rows, (n_row, 3))
+                for k, (_, vals) in enumerate(cols):
+                    save_npy("{}.{}.npy".format(opt_file_name[:-4], k + 4), vals, (n_row,))
+        elif not cols:
+            line = "{}" + sep_out + "{}" + sep_out + "{}\n"
+            self.__write_blocks(opt_file_name, (range(n_row), lambda part: (line * len(part)).format(
+                *rows[3 * part.start:3 * part.stop])))
+        else:
+            line = sep_out.join(["{}"] * 3 + [fmt for fmt, _ in cols]) + "\n"
+            values = [vals for _, vals in cols]
+            self.__write_blocks(opt_file_name, (range(n_row), lambda part: "".join(
+                [line.format(*rows[3 * k:3 * k + 3], *[v[k] for v in values]) for k in part])))
+        ids = self.id_list
+        self.__write_blocks(map_file_name, (range(n_row), lambda part: "".join(
+            [str(k + 1) + sep_out + ids[codes[k]] + "\n" for k in part])))
+        self.stats.count('output_records', n_row)
+
+    def __fmt_opt_rows(self, sep_out=","):
+        """
+        :return: function, codes of self.opt_map -> their lines of the output pedigree
+        """
+        ids = self.id_list
+        get_opt_parents = self.get_opt_parents
+
+        def fmt_block(part):
+            return "".join([ids[code] + sep_out + ids[s] + sep_out + ids[d] + "\n"
+                            for code, (s, d) in zip(part, map(get_opt_parents, part))])
+        return fmt_block
+
+    def __write_blocks(self, opt_file_name, *parts):
+        """
+        Write into opt_file_name, compressed as its extension says or '-' for stdout, self.write_block
+        items at a time
+        :param parts: (items, fmt_block) in order, items being a sequence, fmt_block a function from a slice of
+                      items to text
+        """
+        with self.stats.stage('write'), open_file(opt_file_name, 'w') as fp:
+            for items, fmt_block in parts:
+                if isinstance(items, CodeMap):
+                    items = items.order
+                items = items if isinstance(items, (list, tuple, range, array)) else list(items)
+                for start in range(0, len(items), self.write_block):
+                    fp.write(fmt_block(items[start:start + self.write_block]))
+
+    # 20261018: many animal lists against one loaded pedigree
+    def refine_batch(self, manifest_file_name, rec_gen_max=0, sep_out=",", flag_r=False, n_proc=1):
+        """
+        Run a batch of refine() jobs listed in a manifest file, against the pedigree loaded once.
+        Manifest: one job per line, whitespace delimited "LIST_FILE OUTPUT_FILE [GEN_MAX]", lines starting
+        with sharp ignored. Ancestors of all the gen_max == 0 jobs are populated and sorted only once,
+        each job's output is then picked from them. Jobs may run in n_proc forked processes, sharing
+        the loaded pedigree copy-on-write.
+        :param manifest_file_name: the manifest
+        :param rec_gen_max: gen_max of the jobs not giving one
+        :param sep_out: field separator of the outputs
+        :param flag_r: output descendant IDs, as in refine()
+        :param n_proc: number of processes
+        :return: bool, True if all jobs succeeded
+        """
+        jobs = []
+        if not file_exists(manifest_file_name):
+            self.l.error(" * Batch manifest {} could not be open to read.".format(manifest_file_name))
+            return False
+        with open_file(manifest_file_name, 'r') as fp:
+            for line in fp:
+                vec_tmp = line.split()
+                if not vec_tmp or vec_tmp[0][0] == "#":  # ignore empty or comment lines
+                    continue
+                if len(vec_tmp) not in (2, 3):
+                    self.l.error(" * Batch manifest {}: 2 or 3 fields expected, line [{}]"
+                                 .format(manifest_file_name, line.rstrip("\n")))
+                    return False
+                jobs.append((vec_tmp[0], vec_tmp[1], int(vec_tmp[2]) if len(vec_tmp) == 3 else int(rec_gen_max)))
+        self.l.debug("{} jobs in batch manifest {}".format(len(jobs), manifest_file_name))
+
+        # the whole ancestry of all the gen_max == 0 jobs, populated and sorted once
+        global _batch_pr
+        self.batch_order = None
+        if flag_r:
+            if self.off_ptr is None:
+                self.build_offspring_index()
+        else:
+            lst_all = []
+            for lst_fn, _, gen_max in jobs:
+                if gen_max == 0 and file_exists(lst_fn):
+                    with open_file(lst_fn, 'r') as fp:
+                        lst_all.extend(fp.read().splitlines())
+            if lst_all:
+                self.__populate_opt_map(lst_all, 0)
+                if not self.stem_fault:
+                    self.batch_order = array('i', self.opt_set)
+                    self.l.debug("{} individuals in the ancestry of the gen_max = 0 jobs".format(len(self.batch_order)))
+
+        n_proc = int(n_proc)
+        if n_proc > 1 and 'fork' not in multiprocessing.get_all_start_methods():
+            self.l.warning("  # fork not available, running the batch in one process")
+            n_proc = 1
+        args = [(lst_fn, opt_fn, gen_max, sep_out, flag_r) for lst_fn, opt_fn, gen_max in jobs]
+        if n_proc > 1 and len(jobs) > 1:    # no pool for an empty manifest or a single job
+            _batch_pr = self
+            try:
+                with multiprocessing.get_context('fork').Pool(min(n_proc, len(jobs))) as pool:
+                    rets = pool.starmap(_run_batch_job, args)
+            finally:
+                _batch_pr = None
+        else:
+            rets = [self.refine_job(*arg) for arg in args]
+        for (lst_fn, opt_fn, _), ret in zip(jobs, rets):
+            if not ret:
+                self.l.error(" * batch job {} -> {} failed".format(lst_fn, opt_fn))
+        self.isValid = all(rets)
+        return self.isValid
+
+    def refine_job(self, list_file_name, opt_file_name, rec_gen_max=0, sep_out=",", flag_r=False):
+        """
+        One job of refine_batch(). A gen_max == 0 job picks its ancestry from self.batch_order, by a
+        sweep from offspring to parents, instead of populating and sorting it again.
+        """
+        if flag_r or rec_gen_max != 0 or self.batch_order is None:
+            return self.refine(list_file_name, opt_file_name, rec_gen_max, sep_out, flag_r)
+        if not file_exists(list_file_name):
+            self.l.error(" * AnimalID list file {} could not be open to read.".format(list_file_name))
+            return False
+
+        with open_file(list_file_name, 'r') as fp:
+            anm_list = fp.read().splitlines()
+        self.rec_gen_max = 0
+        self.opt_pruned = None
+        ped_s = self.sire
+        ped_d = self.dam
+        mark = bytearray(len(self.id_list))
+        for idx in anm_list:
+            mark[self.get_code(idx.strip())] = 1
+        mark[0] = 0
+        with self.stats.stage('sweep'):
+            for code in reversed(self.batch_order):
+                if mark[code]:
+                    mark[ped_s[code]] = 1
+                    mark[ped_d[code]] = 1
+        self.__write_opt_ped(opt_file_name, [code for code in self.batch_order if mark[code]], sep_out)
+        return True
+
+    # 20261018: after apply_delta(), only the changed lineages
+    def refresh_refine(self, list_file_name, prev_file_name, opt_file_name, rec_gen_max=0, sep_out=","):
+        """
+        refine() reusing its previous output, prev_file_name, for the same list. A previous row is kept if it
+        and all its ancestors in there have the same parents as in the pedigree now; those rows keep their
+        order, and only the listed IDs and ancestors out of them are populated and sorted again. Falls back
+        to refine() for rec_gen_max != 0, as the generation of a row is not in the output.
+        :param prev_file_name: previous output of refine(list_file_name, ..., sep_out=sep_out)
+        :return: bool, True if success
+        """
+        if rec_gen_max != 0 or not file_exists(prev_file_name):
+            return self.refine(list_file_name, opt_file_name, rec_gen_max, sep_out)
+        if not file_exists(list_file_name):
+            self.l.error(" * AnimalID list file {} could not be open to read.".format(list_file_name))
+            self.isValid = False
+            return False
+
+        with open_file(list_file_name, 'r') as fp:
+            anm_list = fp.read().splitlines()
+        with open_file(prev_file_name, 'r') as fp:
+            text = fp.read()
+        if text and not text.endswith("\n"):
+            text += "\n"
+        lines = text.splitlines(True)
+        cols = _split_lines(text, sep_out, ({}, {}, {}, None)) if len(sep_out) == 1 else None
+        if cols is None:
+            rows = [line.rstrip("\n").split(sep_out) for line in lines]
+            if any(len(row) != 3 for row in rows):
+                self.l.warning("  # previous output {} is not a 3-col file, refined again".format(prev_file_name))
+                return self.refine(list_file_name, opt_file_name, rec_gen_max, sep_out)
+            cols = [list(col) for col in zip(*rows)] if rows else [[], [], []]
+        del text
+
+        get = self.id2code.get
+        with self.stats.stage('refresh'):
+            prev_order = list(map(get, cols[0]))
+            if None in prev_order:      # IDs listed but not in the pedigree
+                prev_order = self.__intern_col(cols[0])
+            codes = self.__list_codes(anm_list)
+            ped_s = self.sire       # may be new arrays in disk mode, once new IDs are interned
+            ped_d = self.dam
+            # a row is clean if its parents did not change, nor those of any of its ancestors; parents come first
+            clean = bytearray(len(self.id_list))
+            clean[0] = 1
+            ids = self.id_list.__getitem__
+            same_s = map(operator.eq, map(ids, map(ped_s.__getitem__, prev_order)), cols[1])
+            same_d = map(operator.eq, map(ids, map(ped_d.__getitem__, prev_order)), cols[2])
+            for code, same in zip(prev_order, map(operator.and_, same_s, same_d)):
+                if same and clean[ped_s[code]] and clean[ped_d[code]]:
+                    clean[code] = 1
+            clean[0] = 0
+            del cols
+
+            # listed IDs and their ancestors up to the clean rows, which are only marked
+            self.rec_gen_max = 0
+            self.opt_pruned = None
+            mark = bytearray(len(self.id_list))
+            for code in codes:
+                mark[code] = clean[code]
+            frontier = [code for code in dict.fromkeys(codes) if not clean[code]]
+            self.opt_map = dict.fromkeys(frontier, 1)
+            edge = OrderedDict()    # clean parents of the rows populated again
+            while frontier:
+                next_gen = []
+                for code in frontier:
+                    for parent in (ped_s[code], ped_d[code]):
+                        if not parent:
+                            continue
+                        if clean[parent]:
+                            mark[parent] = 1
+                            edge[parent] = None
+                        elif parent not in self.opt_map:
+                            self.opt_map[parent] = 1
+                            next_gen.append(parent)
+                frontier = next_gen
+            # the ancestors of the marked clean rows are clean, swept as in refine_job()
+            for code in reversed(prev_order):
+                if mark[code]:
+                    mark[ped_s[code]] = 1
+                    mark[ped_d[code]] = 1
+            kept = list(compress(range(len(prev_order)), map(mark.__getitem__, prev_order)))    # row numbers
+
+        self.l.debug("{} rows kept from {}, {} populated again".format(len(kept), prev_file_name,
+                                                                        len(self.opt_map)))
+        # only the rows populated again are sorted, after the kept ones; self.opt_map and self.opt_set hold
+        # just them
+        self.opt_set = edge
+        n_edge = len(edge)
+        self.stem = ""
+        self.stem_fault = False
+        with self.stats.stage('sort'):
+            self.__sort_opt_set()
+        if self.stem_fault:
+            self.l.error("  * L Pedigree loop detected while filling result set, stem = {}".format(self.stem))
+            self.isValid = False
+            return False
+        self.isValid = True
+        for code in list(islice(self.opt_set, n_edge)):
+            del self.opt_set[code]
+        self.__write_blocks(opt_file_name, (kept, lambda part: "".join([lines[k] for k in part])),
+                            (self.opt_set, self.__fmt_opt_rows(sep_out)))
+        self.stats.count('output_records', len(kept) + len(self.opt_set))
+        return True
+
     # def __single_populate_opt_map(self, idx):
     #     # asserted idx!=self.missing_out
     #
@@ -284,68 +2859,87 @@ class PedRefiner:
     #     self.opt_map[idx] = (sire, dam)
     #     self.rec_gen -= 1
 
-    # 20170222: non-recursive version
-    def __single_populate_opt_map_non_rec(self, id_inp):
+    # 20261018: multi-source, generation by generation
+    def __populate_by_generation(self, codes, rec_gen_max=0):
         """
-        Populate all possible results for a single id, in a non recursive manner
-        :param id_inp:
-        :return:
+        Fill self.opt_map from all the listed codes at once, one generation of ancestors after another.
+        Every ancestor is reached first at its shortest distance from any listed ID and is expanded only then,
+        so each ID is looked at once. Parents of the IDs at generation rec_gen_max are not followed.
+        :param codes: codes of the listed IDs, generation 1
+        :param rec_gen_max: maximum generation, 0 for no limit
         """
-        # asserted idx!=self.missing_out
-        # pre-order
-        td_lst = [id_inp]
-        map_id2gen = {id_inp: 1}
-        while td_lst:
-            idx = td_lst.pop()
-            # self.l.debug("ID = {}, gen = {}".format(idx, cur_gen))
-            # if current id in output map and no rec_gen limit, skip
-            #   because all ancestors of id have been in opt_map
-            if idx in self.opt_map and self.rec_gen_max == 0:
-                continue
-
-            if idx in map_id2gen:
-                cur_gen = map_id2gen.pop(idx)
-            else:
-                cur_gen = 1
-
-            if 0 < self.rec_gen_max <= cur_gen:
-                if idx not in self.opt_map:
-                    self.opt_map[idx] = (self.missing_out, self.missing_out)
-                continue
+        opt_map = self.opt_map
+        frontier = [code for code in dict.fromkeys(codes) if code and code not in opt_map]
+        opt_map.update(dict.fromkeys(frontier, 1))
+        ped_s = self.sire
+        ped_d = self.dam
+        cur_gen = 1
+        while frontier and (rec_gen_max <= 0 or cur_gen < rec_gen_max):
+            cur_gen += 1
+            next_gen = []
+            for code in frontier:
+                sire = ped_s[code]
+                dam = ped_d[code]
+                if sire and sire not in opt_map:
+                    opt_map[sire] = cur_gen
+                    next_gen.append(sire)
+                if dam and dam not in opt_map:
+                    opt_map[dam] = cur_gen
+                    next_gen.append(dam)
+            frontier = next_gen
 
-            if idx in self.ped_map:  # in input ped
-                sire, dam = self.ped_map[idx]
-                if dam != self.missing_out:
-                    td_lst.append(dam)
-                    map_id2gen[dam] = cur_gen + 1
-                if sire != self.missing_out:
-                    td_lst.append(sire)
-                    map_id2gen[sire] = cur_gen + 1
-            else:  # not found
-                sire = dam = self.missing_out
+    def get_opt_parents(self, code):
+        """
+        :param code: code of an ID in self.opt_map
+        :return: (sire code, dam code) as in the output pedigree
+        """
+        if 0 < self.rec_gen_max <= self.opt_map[code]:
+            return 0, 0
+        if self.opt_pruned:
+            sire = self.sire[code]
+            dam = self.dam[code]
+            return (0 if sire in self.opt_pruned else sire), (0 if dam in self.opt_pruned else dam)
+        return self.sire[code], self.dam[code]
 
-            self.opt_map[idx] = (sire, dam)
+    def __list_codes(self, anm_list, unknown=None):
+        """
+        :param anm_list: listed IDs
+        :param unknown: if a list, IDs not in the pedigree are appended to it and left out, instead of interned
+        :return: their codes, IDs not in the pedigree interned to be output with missing parents
+        """
+        ids = [idx for idx in map(str.strip, anm_list) if idx and idx != self.missing_out]
+        codes = list(map(self.id2code.get, ids))
+        if None in codes and unknown is not None:
+            unknown.extend(idx for idx, code in zip(ids, codes) if code is None)
+            codes = [code for code in codes if code is not None]
+        elif None in codes:
+            for k, code in enumerate(codes):
+                if code is None:
+                    codes[k] = self.__intern(ids[k])
+        return codes
 
-    def __populate_opt_map(self, anm_list, rec_gen_max=0):
-        self.opt_map = {}
-        # self.opt_vec = []
-        self.opt_set = OrderedDict()
+    def __populate_opt_map(self, anm_list, rec_gen_max=0, unknown=None):
+        self.stem = ""
+        self.stem_fault = False
         self.rec_gen_max = rec_gen_max
-        for id_inp in anm_list:
-            idx = id_inp.strip()
-            if idx != self.missing_out and idx:
-                # self.stem = idx
-                self.rec_gen = 1
-                # self.__single_populate_opt_map(idx)
-                self.__single_populate_opt_map_non_rec(idx)
+        self.opt_pruned = None
+        with self.stats.stage('populate'):
+            codes = self.__list_codes(anm_list, unknown)
+            if self.disk_dir is None:
+                self.opt_map = {}
+                # self.opt_vec = []
+                self.opt_set = OrderedDict()
+            else:
+                self.opt_map = CodeMap(self.__code_array('i', len(self.id_list)))
+                self.opt_set = CodeMap(self.__code_array('B', len(self.id_list)))
+            self.__populate_by_generation(codes, rec_gen_max)
         
         # make a sorted list in self.opt_vec
         self.l.debug("{} individuals in the result ped. sorting...".format(len(self.opt_map)))
         # self.set_done = set()
-        for idx in self.opt_map:
-            # self.__single_populate_opt_vec(idx)
-            self.__single_populate_opt_vec_non_rec(idx)
-            
+        with self.stats.stage('sort'):
+            self.__sort_opt_set()
+
     # def __single_populate_opt_vec(self, idx):
     #     if idx in self.opt_set:
     #         return
@@ -361,85 +2955,92 @@ class PedRefiner:
     #     #    self.opt_vec.append(idx)
     #     #    self.opt_set.add(idx)
 
-    # 20170222: non recursive version
-    def __single_populate_opt_vec_non_rec(self, id_inp):
+    # 20261018: linear time version, replacing __single_populate_opt_vec_non_rec()
+    def __sort_opt_set(self):
         """
-        Populate sorted output order, in a non recursive manner
-        :param id_inp:
-        :return:
+        Populate sorted output order in self.opt_set, parents before offspring, by a non recursive
+        depth-first post-order over self.opt_map: O(individuals + parent links).
+        A parent met again while its own ancestors are still being visited is a pedigree loop.
+        :return: bool, False if a loop was found
         """
-        if id_inp in self.opt_set:
-            return
+        opt_set = self.opt_set
+        get_opt_parents = self.get_opt_parents
+        for id_inp in self.opt_map:
+            if id_inp in opt_set:
+                continue
+            td_lst = [id_inp]           # current path, from id_inp to its ancestors
+            on_path = {id_inp}
+            while td_lst:
+                idx = td_lst[-1]
+                sire, dam = get_opt_parents(idx)
+                # each individual is looked at once, plus once more after each of its parents is done
+                for parent in (sire, dam):
+                    if parent and parent not in opt_set:
+                        if parent in on_path:
+                            loop = td_lst[td_lst.index(parent):]
+                            self.stem = "[{}], loop: [{}]".format(self.id_list[id_inp], " -> ".join(
+                                self.id_list[x] for x in loop + [parent]))
+                            self.stem_fault = True
+                            return False
+                        td_lst.append(parent)
+                        on_path.add(parent)
+                        break
+                else:
+                    td_lst.pop()
+                    on_path.discard(idx)
+                    opt_set[idx] = None     # just store the ordered key
+        return True
 
-        # local set_done to process only the first occurrence in td_lst2
-        local_map_done = dict()
-        td_lst = [id_inp]
-        td_lst2 = []
-        len_lmd = 0
-        while td_lst:
-            idx = td_lst.pop()
-            td_lst2.append(idx)
-            # self.set_done.add(idx)
-            if idx in local_map_done:
-                local_map_done[idx] += 1
-                # 20150629: prevent loop
-                # 20170224: moved here. if an animal appeared in a pedigree tree more than 10k times, it should be...
-                # 20170225: if a pedigree tree contained N individuals, it is not possible that any individual appeared
-                #           > N times.
-                if local_map_done[idx] > len_lmd:
-                    self.stem = "[{}], tree_size = [{}], repeated > tree_size: [{}]".format(id_inp, len_lmd, idx)
-                    self.stem_fault = True
-                    break
-            else:
-                local_map_done[idx] = 1
-                len_lmd += 1
-
-            sire, dam = self.opt_map[idx]
-            # 20170223: prevent unexpected order for complex pedigree while specifying rec_gen_max
-            """ 20170223
-            A B     A
-             C D     H
-              E       G
-                  F
-
-            'A' needs to be stacked after 'H', but in fact it is 'C' in ORIGINAL CODE
-            to fix this, need an extra set in the 2nd while loop
-            ===================== ORIGINAL CODE before 20170223
-            if dam != self.missing_out and dam not in self.set_done:
-                td_lst.append(dam)
-            if sire != self.missing_out and sire not in self.set_done:
-                td_lst.append(sire)
-            """
-            # push dam/sire again in order to make them appear prior to offspring
-            if dam not in self.opt_set:    # 20170224: ignore if already in a previously processed tree
-                if dam in local_map_done:
-                    td_lst.append(dam)      # process again, in order to promote it and its ancestors
-                elif dam != self.missing_out:
-                    td_lst.append(dam)
-
-            if sire not in self.opt_set:
-                if sire in local_map_done:
-                    td_lst.append(sire)
-                elif sire != self.missing_out:
-                    td_lst.append(sire)
-
-        # local set_done to process only the first occurrence in td_lst2
-        local_set_done = set()
-        while td_lst2:
-            idx = td_lst2.pop()
-            if idx not in local_set_done:
-                self.opt_set[idx] = None    # just store the ordered key
-                local_set_done.add(idx)
-
-            # self.l.debug("        insert {}".format(id_inp))
+    # 20261018: smaller output for mixed-model solvers
+    def __prune_opt_set(self, anm_list, min_offspring=2):
+        """
+        Drop uninformative ancestors from the sorted output, self.opt_set: IDs not listed, without parents in
+        the output once the dropped ones are taken as missing, and with fewer than min_offspring offspring in
+        it. Their offspring are written with missing parents in their place. min_offspring 2, founders with
+        a single offspring, down the lines they start, keeps the relationships and the inbreeding of all the
+        IDs left; a larger one also drops the founders of small families, and the relationships through them.
+        :param anm_list: listed IDs
+        :param min_offspring: founders with fewer offspring in the output are dropped
+        :return: number of IDs dropped
+        """
+        with self.stats.stage('prune'):
+            order = list(self.opt_set)
+            parents = list(map(self.get_opt_parents, order))
+            n_off = Counter(chain.from_iterable(parents))
+            listed = set(self.__list_codes(anm_list, []))
+            pruned = set()
+            for code, (sire, dam) in zip(order, parents):     # parents first
+                if n_off[code] < min_offspring and (not sire or sire in pruned) and (not dam or dam in pruned) \
+                        and code not in listed:
+                    pruned.add(code)
+            if pruned:
+                if isinstance(self.opt_set, CodeMap):
+                    self.opt_set = CodeMap(self.__code_array('B', len(self.id_list)))
+                else:
+                    self.opt_set = OrderedDict()
+                self.opt_set.update((code, None) for code in order if code not in pruned)
+                self.opt_pruned = pruned
+        n_row = len(order)
+        self.l.debug("pruning: {} of {} IDs dropped, output {:.1f}% smaller".format(
+            len(pruned), n_row, 100. * len(pruned) / max(n_row, 1)))
+        self.stats.count('pruned', len(pruned))
+        return len(pruned)
 
     def pipeline(self, lst_fn, ped_fn, opt_fn, gen_max=0, missing_in='.', missing_out='.',
-                 sep_in=',', sep_out=',', xref_fn=None, flag_r=False):
+                 sep_in=',', sep_out=',', xref_fn=None, flag_r=False, cache_dir=None, n_proc=1,
+                 stats_fn=None, profile=None, report_fn=None, delta_fn=None, prev_fn=None, map_fn=None,
+                 inbreeding=0, mem_mb=None, prune=0):
         """
 Suggested usage of PedRefiner: the pipeline() method.
 
-:param  1 lst_fn:              file containing animal list to be grepped from the pedigree, one line each
-:param  2 ped_fn:              input pedigree file, 3 col
+:param  1 lst_fn:              file containing animal list to be grepped from the pedigree, one line each;
+                               or '@' followed by a batch manifest file, one job per line:
+                               LIST_FILE OUTPUT_FILE [GEN_MAX], opt_fn being ignored
+:param  2 ped_fn:              input pedigree file, 3 col, or 4 with a birth date (YYYYMMDD, YYYY-MM-DD, ...)
+                               checked to be after the parents'; or '@' followed by a sources manifest, one input
+                               pedigree per line: FILE [SEP_IN [MISSING_IN [PRIORITY]]], \\t for a tab. They are
+                               merged in one pass each, a duplicated record taken from the source of the highest
+                               PRIORITY (0), the last listed of equal ones; counted per source in the statistics
 :param  3 opt_fn:              output pedigree file, 3 col
 :param  4 gen_max:     (0)     maximum recursive generation to grep for EVERYONE in lst_fn
 :param  5 missing_in:  ('.')   missing value in input file, default = '.'
@@ -447,7 +3048,39 @@ Suggested usage of PedRefiner: the pipeline() method.
 :param  7 sep_in:      (',')   field separator in input file, default = ',' i.e. csv
 :param  8 sep_out:     (',')   field separator in output file, default = ',', i.e. csv
 :param  9 xref_fn:     (None)  cross-reference file to modify output pedigree
-:param 10 flag_r:      (False) bool, output descendant IDs if True. TODO: not implemented yet in Python version
+:param 10 flag_r:      (False) bool, output descendant IDs if True, one per line, up to gen_max generations
+:param 11 cache_dir:   (None)  directory of binary pedigree caches. The loaded and checked pedigree is cached
+                               there, keyed by the input file, xref file, sep_in, missing_in and missing_out;
+                               later runs with the same key skip loading and checking
+:param 12 n_proc:      (1)     number of processes running the jobs of a batch manifest
+:param 13 stats_fn:    (None)  JSON file receiving the run statistics: wall time, CPU time and peak memory of
+                               each stage, counts of records, duplicates, xref hits, missing parents, output
+:param 14 profile:     (None)  'cprofile' to dump pedRefiner.STAGE.prof files of each stage into the current
+                               directory, 'tracemalloc' to add the top allocating lines to the statistics
+:param 15 report_fn:   (None)  file listing every self-parent and duplicated record of the input pedigree, and
+                               every issue found by check(): sex conflicts, parents without a record or born
+                               after their offspring; only the totals and the first 10 of each are logged
+:param 16 delta_fn:    (None)  delta file applied to the loaded or cached pedigree, whitespace delimited:
+                               '+ ID SIRE DAM [BIRTH]' adds or corrects a record, '- ID' deletes it. Only the
+                               changed IDs and their parents are checked again
+:param 17 prev_fn:     (None)  previous output of the same lst_fn, refreshed for the changed lineages instead of
+                               refined again; gen_max 0 only
+:param 18 map_fn:      (None)  number -> ID map file. If given, opt_fn is renumbered 1..n in output order, missing
+                               parents being 0, ready for BLUP solvers; an opt_fn ending with .npy is written as
+                               an int32 array of shape (n, 3). prev_fn is not used then
+:param 19 inbreeding:  (0)     1 to add the inbreeding coefficient of each output ID as a 4th column (Colleau,
+                               sire by sire), 2 to add its generation depth as a 5th; both computed on the output
+                               pedigree. With a .npy opt_fn they go into PED_OUTPUT.4.npy and PED_OUTPUT.5.npy.
+                               prev_fn is not used then
+:param 20 mem_mb:      (None)  memory budget, MB. If loading ped_fn in memory would take more, disk mode: IDs are
+                               interned through SQLite and the pedigree and the arrays of check() and of the
+                               ancestors are memory-mapped files in cache_dir, or the temporary directory
+:param 21 prune:       (0)     2 or more to drop uninformative ancestors from opt_fn: not listed, without parents
+                               in the output once the dropped ones are missing, and with fewer offspring in it.
+                               2 keeps all the relationships and inbreeding coefficients; larger values also drop
+                               the founders of small families. The number dropped is logged and counted.
+                               prev_fn and batch manifests do not prune
+:return:                       PedStats, the run statistics
 
 Example
 
@@ -458,31 +3091,265 @@ Example
     pr.pipeline('animal_list', 'ped.input.csv', 'ped.output.csv', gen_max=3)
 
 - Bash
-    #             1       2             3               4gen_max  5missin  6missout  7sepin 8sepout 9    10
-    pedRefiner.py ANM_LST PED_INPUT.csv PED_OUTPUT.csv [3         0        0         ,      ,       xref True]
+    #             1       2             3               4gen_max  5missin  6missout  7sepin 8sepout 9    10   11    12
+    pedRefiner.py ANM_LST PED_INPUT.csv PED_OUTPUT.csv [3         0        0         ,      ,       xref True cache 4]
+    pedRefiner.py @JOBS   PED_INPUT.csv -              [3         0        0         ,      ,       xref True cache 4]
+    #  13         14       15         16    17                  18             19 20   21
+    [  stats.json cprofile report.txt delta PED_OUTPUT.prev.csv PED_OUTPUT.map 2  4096 2]
+        """
+        if isinstance(flag_r, str):     # from the command line
+            flag_r = flag_r.lower() in ('true', '1', 'yes', '-r')
+        self.stats = PedStats(profile)
+        # 20261018: the pedigree is parsed in one process, parsing it in n_proc is not faster, see __load_parallel()
+        ret = self.load_checked(ped_fn, missing_in, missing_out, sep_in, xref_fn, cache_dir, 1, report_fn, mem_mb)
+        if ret and delta_fn and delta_fn != 'None':
+            codes = self.apply_delta(delta_fn)
+            ret = codes is not None and self.check(codes, report_fn)
+            if not ret:
+                self.l.error('error applying delta {}'.format(delta_fn))
+        if map_fn == 'None':
+            map_fn = None
+        if ret:
+            inbreeding = int(inbreeding)
+            prune = int(prune)
+            if prev_fn and prev_fn != 'None' and not flag_r and not map_fn and not inbreeding and prune < 2 and \
+                    not lst_fn.startswith('@'):
+                self.refresh_refine(lst_fn, prev_fn, opt_fn, int(gen_max), sep_out)
+            else:
+                self.__refine_any(lst_fn, opt_fn, gen_max, sep_out, flag_r, n_proc, map_fn, inbreeding, prune)
+        self.l.debug("run statistics\n{}".format(self.stats))
+        if stats_fn and stats_fn != 'None':
+            self.stats.save(stats_fn)
+        return self.stats
+
+    def load_checked(self, ped_fn, missing_in='.', missing_out='.', sep_in=',', xref_fn=None, cache_dir=None,
+                     n_proc=1, report_fn=None, mem_mb=None):
         """
-        if xref_fn is not None:
+        xref, load_ped() and check(), or load_cache() if cache_dir holds a cache for the same settings
+        :param mem_mb: memory budget, MB. Disk mode if estimate_mem_mb() is over it or unknown, in cache_dir or
+                       the temporary directory; the SQLite cache of load_ped() gets a quarter of it
+        :return: bool, True if the pedigree is ready to refine
+        """
+        disk_dir = None
+        if mem_mb and mem_mb != 'None':
+            mem_mb = float(mem_mb)
+            try:
+                est_mb = [estimate_mem_mb(src[0]) for src in get_sources(ped_fn, sep_in, missing_in)]
+                est_mb = None if None in est_mb else sum(est_mb)
+            except ValueError:
+                est_mb = None
+            if est_mb is None or est_mb > mem_mb:
+                disk_dir = cache_dir if cache_dir and cache_dir != 'None' else tempfile.gettempdir()
+                self.sqlite_cache_mb = max(mem_mb / 4, 1)
+                self.l.debug("disk mode in {}, about {} MB needed in memory, {:.0f} MB allowed".format(
+                    disk_dir, "?" if est_mb is None else round(est_mb), mem_mb))
+        if xref_fn is not None:     # before the cache too: apply_delta() goes through the xref maps
             self.l.debug('loading xref')
             self.load_xref_map(xref_fn)
+        cache_fn = cache_key = None
+        if cache_dir and cache_dir != 'None' and ped_fn != '-':
+            try:
+                cache_key = get_cache_key(ped_fn, xref_fn, sep_in, missing_in, missing_out)
+                cache_fn = os.path.join(cache_dir, "pedRefiner.{}.cache".format(cache_key))
+            except (OSError, ValueError):     # left to load_ped() to report
+                cache_key = None
+            if cache_fn is not None and os.path.exists(cache_fn):
+                self.l.debug('loading ped from cache')
+                with self.stats.stage('load_cache'):
+                    ret_cache = self.load_cache(cache_fn, cache_key, disk_dir)
+                if ret_cache:
+                    self.missing_in = missing_in
+                    self.stats.counts['records'] = self.n_rec
+                    return True
+
         self.l.debug('loading ped and then check')
-        ret_load = self.load_ped(ped_fn, sep_in, missing_in, missing_out)
+        ret_load = self.load_ped(ped_fn, sep_in, missing_in, missing_out, n_proc, report_fn, disk_dir)
         if ret_load:
-            ret_check = self.check()
+            ret_check = self.check(report_fn=report_fn)
             if ret_check:
-                self.refine(lst_fn, opt_fn, int(gen_max), sep_out, bool(flag_r))
+                if cache_fn is not None:
+                    self.save_cache(cache_fn, cache_key)
+                return True
             else:
                 self.l.error('error checking pedigree')
         else:
             self.l.error('error loading input pedigree')
+        return False
+
+    def __refine_any(self, lst_fn, opt_fn, gen_max, sep_out, flag_r, n_proc, map_fn=None, inbreeding=0, prune=0):
+        if lst_fn.startswith('@'):
+            return self.refine_batch(lst_fn[1:], int(gen_max), sep_out, bool(flag_r), int(n_proc))
+        return self.refine(lst_fn, opt_fn, int(gen_max), sep_out, bool(flag_r), map_fn, inbreeding, prune)
+
+    # 20261018: resident query server
+    def serve(self, ped_fn, port=8964, missing_in='.', missing_out='.', sep_in=',', sep_out=',',
+              xref_fn=None, cache_dir=None, host='127.0.0.1'):
+        """
+        Load and check the pedigree once, then answer queries over HTTP until interrupted.
+
+        POST /refine?gen_max=3          body: IDs, whitespace delimited; or GET /refine?id=A&id=B&gen_max=3
+                                        -> refined pedigree, as refine() writes it
+        POST /descendants?gen_max=0     -> descendant IDs, as refine(flag_r=True) writes them
+        GET  /reload[?force=1]          -> reload the pedigree if ped_fn or xref_fn changed on disk
+        GET  /status                    -> JSON
+
+        Queries are answered by any number of concurrent clients, and streamed. The work per query only
+        depends on the size of its answer.
+        """
+        server = PedServer((host, int(port)), self, ped_fn, missing_in, missing_out, sep_in, sep_out,
+                           xref_fn, cache_dir)
+        if not server.reload(force=True):
+            server.server_close()
+            return False
+        self.l.info("serving pedigree {} on http://{}:{}/".format(ped_fn, host, server.server_port))
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+        return True
 
     def help(self):
         print(self.pipeline.__doc__)
 
+
+class PedServer(ThreadingHTTPServer):
+    """
+    HTTP server around a loaded PedRefiner, see PedRefiner.serve(). Queries run one at a time on the
+    shared PedRefiner under self.lock, their answers are streamed outside of it.
+    """
+    daemon_threads = True
+
+    def __init__(self, address, pr, ped_fn, missing_in, missing_out, sep_in, sep_out, xref_fn, cache_dir):
+        super().__init__(address, PedRequestHandler)
+        self.pr = pr
+        self.lock = threading.Lock()
+        self.load_args = (ped_fn, missing_in, missing_out, sep_in, xref_fn, cache_dir)
+        self.sep_out = sep_out
+        self.file_stat = None
+
+    def get_file_stat(self):
+        ped_fn, _, _, _, xref_fn, _ = self.load_args
+        ret = []
+        fns = [ped_fn, xref_fn]
+        if ped_fn.startswith('@'):
+            try:
+                fns.extend(src[0] for src in get_sources(ped_fn))
+            except ValueError:
+                pass
+        for fn in fns:
+            if fn and os.path.exists(fn):
+                st = os.stat(fn)
+                ret.append((st.st_size, st.st_mtime_ns))
+            else:
+                ret.append(None)
+        return ret
+
+    def reload(self, force=False):
+        """
+        Load the pedigree into a new PedRefiner, replacing the served one if successful
+        :param force: reload even if the files did not change
+        :return: bool, True if the served pedigree is up to date
+        """
+        file_stat = self.get_file_stat()
+        if not force and file_stat == self.file_stat:
+            return True
+        pr = PedRefiner()
+        if not pr.load_checked(*self.load_args):
+            return False
+        pr.build_offspring_index()
+        with self.lock:
+            self.pr = pr
+            self.file_stat = file_stat
+        return True
+
+
+class PedRequestHandler(BaseHTTPRequestHandler):
+    server_version = "pedRefiner"
+    block_size = 10000      # lines per write
+
+    def do_GET(self):
+        self.__handle(False)
+
+    def do_POST(self):
+        self.__handle(True)
+
+    def __handle(self, has_body):
+        url = urlparse(self.path)
+        query = parse_qs(url.query)
+        server = self.server
+        try:
+            gen_max = int(query.get('gen_max', ['0'])[0])
+        except ValueError:
+            self.send_error(400, "gen_max is not an integer")
+            return
+        anm_list = query.get('id', [])
+        if has_body:
+            length = int(self.headers.get('Content-Length', 0))
+            anm_list.extend(self.rfile.read(length).decode('utf-8').split())
+
+        if url.path == '/refine':
+            unknown = []
+            with server.lock:
+                pr = server.pr
+                rows = pr.query_refine(anm_list, gen_max, unknown=unknown)
+            if rows is None:
+                self.send_error(409, "pedigree loop: {}".format(pr.stem))
+                return
+            ids = pr.id_list
+            sep_out = server.sep_out
+            # IDs not in the pedigree first, as founders
+            self.__stream(chain(("{1}{0}{2}{0}{2}\n".format(sep_out, idx, pr.missing_out)
+                                 for idx in dict.fromkeys(unknown)),
+                                ("{1}{0}{2}{0}{3}\n".format(sep_out, ids[code], ids[s], ids[d])
+                                 for code, s, d in rows)))
+        elif url.path == '/descendants':
+            with server.lock:
+                pr = server.pr
+                desc = pr.get_descendant_codes([pr.get_code(idx) for idx in anm_list], gen_max)
+            ids = pr.id_list
+            self.__stream((ids[code] + "\n" for code in desc))
+        elif url.path == '/reload':
+            force = query.get('force', ['0'])[0].lower() in ('1', 'true', 'yes')
+            if server.reload(force):
+                self.__stream(["reloaded\n"])
+            else:
+                self.send_error(500, "error reloading pedigree, still serving the previous one")
+        elif url.path == '/status':
+            pr = server.pr
+            with server.lock:
+                stats = pr.stats.as_dict()
+            self.__stream([json.dumps({"ped_fn": server.load_args[0], "n_rec": pr.n_rec,
+                                       "n_id": len(pr.id_list) - 1, "stats": stats}) + "\n"], "application/json")
+        else:
+            self.send_error(404)
+
+    def __stream(self, lines, content_type="text/plain; charset=utf-8"):
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.end_headers()
+        block = []
+        for line in lines:
+            block.append(line)
+            if len(block) >= self.block_size:
+                self.wfile.write("".join(block).encode('utf-8'))
+                block = []
+        if block:
+            self.wfile.write("".join(block).encode('utf-8'))
+
+    def log_message(self, fmt, *args):
+        self.server.pr.l.debug("{} {}".format(self.address_string(), fmt % args))
+
 if __name__ == "__main__":
+    logging.basicConfig(format="%(name)s %(asctime)s : %(levelname)-7s | %(message)s", datefmt="%H:%M:%S",
+                        level=logging.DEBUG)
     pr = PedRefiner()
 
     if len(sys.argv) == 1:
         pr.help()
+    elif sys.argv[1] in ('-s', '--serve'):
+        pr.serve(*sys.argv[2:])
     else:
         pr.pipeline(*sys.argv[1:])
     """
@@ -1,7 +1,7 @@
 #!/usr/bin/env python3
 # encoding: utf8
 
-from distutils.core import setup
+from setuptools import setup
 
 setup(
     name='pedRefiner',
@@ -21,11 +21,13 @@ setup(
     download_url='https://github.com/cbkmephisto/' +
                  'pedRefiner.py/archive/0.1.zip',
     scripts=['pedRefiner/pedRefiner.py'],
+    python_requires='>=3.8',
     # arbitrary keywords
     keywords=['pedigree', 'refine', 'extract', 'ancestors'],
     classifiers=[
         "Programming Language :: Python",
         "Programming Language :: Python :: 3",
+        "Programming Language :: Python :: 3 :: Only",
         "Development Status :: 4 - Beta",
         "Environment :: Console",
         "Intended Audience :: Science/Research",
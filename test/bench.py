@@ -0,0 +1,218 @@
+#!/usr/bin/env python3
+"""
+Pedigree benchmark: generates the gen_bench_ped.py cases, times each stage of PedRefiner on them, together with
+the original PedRefiner of ref_pedRefiner.py as a reference timed in the same run, and compares the ratios of the
+two against a stored baseline.
+
+usage: bench.py [-n N] [-k KIND,KIND...] [-s SEED] [-r REPEAT] [-b BASELINE] [-o RESULT] [-t TOLERANCE]
+                [-w WORK_DIR] [-u]
+
+Each case runs in a fresh process, REPEAT times for each version, the median wall time of each stage kept. Stages:
+xref, load_ped, check, refine_g0 and refine_g3 (ancestors populated and sorted, gen_max 0 and 3), write (refine()
+to a file), descendants (offspring index and the descendants of 10 founders). peak_mb is the peak memory of the
+process at the end of the stage. The reference, the original dict-of-tuples PedRefiner, runs xref and load_ped
+only.
+The ratio of a stage is its wall time over that of the same stage of the reference, or of its load_ped for the
+other stages, so that the baseline holds no absolute time of one host. A stage regresses if its ratio
+is above the baseline's by more than the tolerance and by more than 0.05 s on this host, or if it is bigger than
+the baseline by more than the tolerance and by more than 5 MB. Exit status 1 on regression.
+"""
+
+import os
+import sys
+import json
+import time
+import platform
+import argparse
+import statistics
+import tempfile
+import subprocess
+
+import gen_bench_ped
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+BASELINE = os.path.join(HERE, "bench_baseline.json")
+
+
+def run_case(ped_fn, lst_fn, xref_fn, reference=False):
+    """
+    Time the stages on one case, in this process
+    :param reference: time the original PedRefiner of ref_pedRefiner.py, xref and load_ped only
+    :return: dict, stage -> {'wall': seconds, 'peak_mb': MB}
+    """
+    sys.path.insert(0, os.path.join(HERE, "..", "pedRefiner"))
+    from pedRefiner import get_peak_mem_mb
+    if reference:
+        from ref_pedRefiner import PedRefiner
+    else:
+        from pedRefiner import PedRefiner
+
+    stats = {}
+
+    def stage(name, func, *args):
+        t_start = time.perf_counter()
+        ret = func(*args)
+        stats[name] = {'wall': round(time.perf_counter() - t_start, 4), 'peak_mb': round(get_peak_mem_mb(), 1)}
+        return ret
+
+    def descendants():
+        founders = [code for code in range(1, min(len(pr.id_list), 1000)) if pr.has_rec[code]][:10]
+        pr.build_offspring_index()
+        return pr.get_descendant_codes(founders)
+
+    with open(lst_fn, 'r') as fp:
+        anm_list = fp.read().splitlines()
+    pr = PedRefiner()
+    if xref_fn:
+        stage('xref', pr.load_xref_map, xref_fn)
+    stage('load_ped', pr.load_ped, ped_fn)
+    if reference:
+        return stats
+    stage('check', pr.check)
+    stage('refine_g0', pr.query_refine, anm_list, 0)
+    stage('refine_g3', pr.query_refine, anm_list, 3)
+    stage('write', pr.refine, lst_fn, ped_fn + ".out", 0)
+    stage('descendants', descendants)
+    return stats
+
+
+def run_median(case, repeat):
+    """
+    run_case() of PedRefiner and of the reference in fresh processes, one after the other, repeat times each
+    :param case: [PED, LIST, XREF]
+    :return: (stages, stages of the reference), dicts of stage -> {'wall': median seconds, 'peak_mb': MB};
+             None if a run failed
+    """
+    runs = ({}, {})     # stage -> list of {'wall', 'peak_mb'}
+    for _ in range(repeat):
+        for stages, opt in zip(runs, ([], ['--ref'])):
+            proc = subprocess.run([sys.executable, os.path.abspath(__file__), '--case'] + case + opt,
+                                  cwd=os.path.dirname(case[0]), stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+                                  universal_newlines=True)
+            if proc.returncode:
+                return None
+            for name, st in json.loads(proc.stdout).items():
+                stages.setdefault(name, []).append(st)
+    return tuple({name: {'wall': statistics.median(st['wall'] for st in sts),
+                         'peak_mb': max(st['peak_mb'] for st in sts)} for name, sts in stages.items()}
+                 for stages in runs)
+
+
+def set_ratios(stages, ref):
+    """
+    Add to each stage its 'ratio' of wall times, over the same stage of the reference or over its load_ped
+    """
+    for name, st in stages.items():
+        st['ratio'] = round(st['wall'] / max(ref.get(name, ref['load_ped'])['wall'], 1e-6), 4)
+
+
+def compare(result, baseline, tolerance):
+    """
+    Print each stage against the reference of this run and the baseline
+    :return: list of regressions, "kind stage what"
+    """
+    regressions = []
+    if baseline.get('n') != result['n'] or baseline.get('seed') != result['seed'] or \
+            any('ratio' not in st for stages in baseline.get('cases', {}).values() for st in stages.values()):
+        print("# baseline is for n = {}, seed = {}, or has no ratios; not compared".format(baseline.get('n'),
+                                                                                         baseline.get('seed')))
+        baseline = {}
+    print("{:8} {:12} {:>9} {:>9} {:>7} {:>7} {:>9} {:>9}".format("case", "stage", "wall", "ref", "ratio", "base",
+                                                                 "peak_mb", "base"))
+    for kind, stages in result['cases'].items():
+        ref = result['reference']['cases'][kind]
+        for name, st in stages.items():
+            ref_wall = ref.get(name, ref['load_ped'])['wall']
+            base = baseline.get('cases', {}).get(kind, {}).get(name)
+            if base is None:
+                print("{:8} {:12} {:9.3f} {:9.3f} {:7.3f} {:>7} {:9.1f} {:>9}".format(kind, name, st['wall'], ref_wall,
+                                                                                     st['ratio'], "-",
+                                                                                     st['peak_mb'], "-"))
+                continue
+            flag = ""
+            if st['ratio'] > base['ratio'] * (1 + tolerance) and st['wall'] - base['ratio'] * ref_wall > 0.05:
+                regressions.append("{} {} wall".format(kind, name))
+                flag += " SLOWER"
+            if st['peak_mb'] > base['peak_mb'] * (1 + tolerance) and st['peak_mb'] - base['peak_mb'] > 5:
+                regressions.append("{} {} memory".format(kind, name))
+                flag += " BIGGER"
+            print("{:8} {:12} {:9.3f} {:9.3f} {:7.3f} {:7.3f} {:9.1f} {:9.1f}{}".format(kind, name, st['wall'],
+                                                                                       ref_wall, st['ratio'],
+                                                                                       base['ratio'], st['peak_mb'],
+                                                                                       base['peak_mb'], flag))
+    for kind, stages in result['cases'].items():
+        for name, ref in result['reference']['cases'][kind].items():
+            st = stages[name]
+            print("# {:8} {:12} {:.3f} s, speedup {:.2f} over the reference {:.3f} s; {:.1f} MB, reference {:.1f}"
+                  .format(kind, name, st['wall'], ref['wall'] / max(st['wall'], 1e-6), ref['wall'],
+                          st['peak_mb'], ref['peak_mb']))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="pedRefiner benchmark")
+    parser.add_argument('-n', type=int, default=200000, help="records per case (200000)")
+    parser.add_argument('-k', default=",".join(gen_bench_ped.KINDS), help="cases, comma separated (all)")
+    parser.add_argument('-s', type=int, default=1, help="random seed (1)")
+    parser.add_argument('-r', type=int, default=5, help="runs of each case and version, the median kept (5)")
+    parser.add_argument('-b', default=BASELINE, help="baseline JSON (bench_baseline.json)")
+    parser.add_argument('-o', default=None, help="write the results into this JSON file")
+    parser.add_argument('-t', type=float, default=.25, help="tolerance, as a fraction of the baseline (0.25)")
+    parser.add_argument('-w', default=None, help="work directory, kept (a temporary one)")
+    parser.add_argument('-u', action='store_true', help="update the baseline with the results")
+    parser.add_argument('--case', nargs=3, help=argparse.SUPPRESS)     # PED LIST XREF, run in a child process
+    parser.add_argument('--ref', action='store_true', help=argparse.SUPPRESS)  # --case of the reference
+    args = parser.parse_args()
+
+    if args.case:
+        print(json.dumps(run_case(args.case[0], args.case[1], args.case[2] or None, args.ref)))
+        return 0
+
+    kinds = args.k.split(",")
+    for kind in kinds:
+        if kind not in gen_bench_ped.KINDS:
+            parser.error("unknown case {}, one of {}".format(kind, ", ".join(gen_bench_ped.KINDS)))
+    tmp_dir = None
+    work_dir = args.w
+    if work_dir is None:
+        tmp_dir = tempfile.TemporaryDirectory(prefix="pedRefiner.bench.")
+        work_dir = tmp_dir.name
+    os.makedirs(work_dir, exist_ok=True)
+
+    result = {'n': args.n, 'seed': args.s, 'python': platform.python_version(), 'machine': platform.machine(),
+              'cases': {}, 'reference': {'loader': "ref_pedRefiner.py, the original dict-of-tuples PedRefiner",
+                                         'cases': {}}}
+    for kind in kinds:
+        ped_fn, lst_fn, xref_fn = gen_bench_ped.write_case(kind, args.n, os.path.join(work_dir, kind), args.s)
+        runs = run_median([ped_fn, lst_fn, xref_fn or ""], args.r)
+        if runs is None:
+            print("# case {} failed".format(kind))
+            return 2
+        stages, ref = runs
+        set_ratios(stages, ref)
+        result['cases'][kind] = stages
+        result['reference']['cases'][kind] = ref
+    if tmp_dir is not None:
+        tmp_dir.cleanup()
+
+    if args.o:
+        with open(args.o, 'w') as fp:
+            json.dump(result, fp, indent=1)
+    baseline = {}
+    if os.path.exists(args.b):
+        with open(args.b, 'r') as fp:
+            baseline = json.load(fp)
+    regressions = compare(result, baseline, args.t)
+    if args.u:
+        with open(args.b, 'w') as fp:
+            json.dump(result, fp, indent=1)
+        print("# baseline {} updated".format(args.b))
+        return 0
+    if regressions:
+        print("# {} regression(s): {}".format(len(regressions), "; ".join(regressions)))
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
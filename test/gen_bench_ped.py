@@ -0,0 +1,173 @@
+#!/usr/bin/env python3
+"""
+Synthetic pedigrees for bench.py
+
+usage: gen_bench_ped.py KIND N PREFIX [SEED]
+    writes PREFIX.csv (pedigree, 3 col), PREFIX.list (animals to refine) and, for KIND xref, PREFIX.xref
+
+KIND
+    chain    deep chains, listed offspring first
+    halfsib  wide half-sib families of a few sires, dams without records
+    inbred   overlapping generations, most sires drawn from a few popular ones
+    dup      as inbred, plus duplicated records, same or different
+    xref     as inbred, with aliases resolved by an A/S/D xref file
+    loop     as inbred, with injected pedigree loops
+"""
+
+import sys
+import random
+
+KINDS = ('chain', 'halfsib', 'inbred', 'dup', 'xref', 'loop')
+
+
+def population(n, rng, n_popular=0, p_popular=0.):
+    """
+    Overlapping generations: sires and dams drawn from the 3 previous generations, some parents missing
+    :param n: number of records
+    :param rng: random.Random
+    :param n_popular: number of popular sires, re-drawn from the last generation's males
+    :param p_popular: probability of a popular sire
+    :return: list of [ID, sire, dam], parents before offspring; list of male IDs
+    """
+    gen_size = max(100, n // 20)
+    rows = []
+    males = []     # per generation
+    females = []
+    gen_m = []
+    gen_f = []
+    popular = []
+    all_m = []
+    for i in range(n):
+        if i and i % gen_size == 0:
+            males.append(gen_m)
+            females.append(gen_f)
+            if n_popular and gen_m:
+                popular = rng.sample(gen_m, min(n_popular, len(gen_m)))
+            gen_m = []
+            gen_f = []
+        idx = "US%010d" % i
+        sire = dam = '.'
+        if males:
+            if popular and rng.random() < p_popular:
+                sire = rng.choice(popular)
+            elif rng.random() > .05:
+                sire = rng.choice(males[-rng.randint(1, min(3, len(males)))] or all_m or ['.'])
+            if rng.random() > .03:
+                dam = rng.choice(females[-rng.randint(1, min(3, len(females)))] or ['.'])
+        rows.append([idx, sire, dam])
+        if rng.random() < .5:
+            gen_m.append(idx)
+            all_m.append(idx)
+        else:
+            gen_f.append(idx)
+    return rows, all_m
+
+
+def gen_chain(n, rng):
+    n_chain = 1 + n // 250000
+    depth = max(1, n // (2 * n_chain))
+    rows = []
+    lst = []
+    for c in range(n_chain):
+        lst.append("C{}_{}".format(c, 0))
+        for j in range(depth):      # offspring first, the parents come in the next rows
+            rows.append(["C{}_{}".format(c, j), "C{}_{}".format(c, j + 1), "D{}_{}".format(c, j)])
+            rows.append(["D{}_{}".format(c, j), '.', '.'])
+    return rows, lst
+
+
+def gen_halfsib(n, rng):
+    n_sire = max(2, n // 2000)
+    sires = ["S%06d" % k for k in range(n_sire)]
+    rows = [[s, '.', '.'] for s in sires]
+    for i in range(n - n_sire):
+        rows.append(["H%09d" % i, rng.choice(sires), "F%09d" % i])  # dams have no record
+    return rows, [row[0] for row in rng.sample(rows[n_sire:], max(10, n // 100))]
+
+
+def gen_inbred(n, rng):
+    rows, _ = population(n, rng, n_popular=5, p_popular=.8)
+    return rows, pick_list(rows, rng)
+
+
+def gen_dup(n, rng):
+    n_dup = n // 10
+    rows, _ = population(n - n_dup, rng, n_popular=5, p_popular=.8)
+    dups = []
+    for row in rng.sample(rows, n_dup):
+        if rng.random() < .5:
+            dups.append(list(row))                              # same
+        else:
+            dups.append([row[0], rng.choice(rows)[0], row[2]])  # different sire
+    lst = pick_list(rows, rng)
+    rows.extend(dups)
+    return rows, lst
+
+
+def gen_xref(n, rng, xref_lines):
+    rows, _ = population(n, rng, n_popular=5, p_popular=.8)
+    alias = {}
+    for row in rng.sample(rows, n // 5):
+        alias[row[0]] = "X" + row[0]
+        xref_lines.append("A X{0} {0}".format(row[0]))
+    for row in rows:
+        for i in range(3):
+            if row[i] in alias and rng.random() < .5:
+                row[i] = alias[row[i]]
+    for row in rng.sample(rows, n // 100):
+        if row[1] != '.':
+            xref_lines.append("S {} .".format(row[1]))
+        if row[2] != '.':
+            xref_lines.append("D {} .".format(row[2]))
+    return rows, pick_list(rows, rng)
+
+
+def gen_loop(n, rng):
+    rows, males = population(n, rng, n_popular=5, p_popular=.8)
+    pos = {row[0]: k for k, row in enumerate(rows)}
+    n_loop = 5 * (1 + n // 100000)
+    for x in rng.sample(males[len(males) // 2:], n_loop):
+        k = pos[x]
+        seen = {k}
+        while rows[k][1] in pos and pos[rows[k][1]] not in seen:   # up the sire line, to the top
+            k = pos[rows[k][1]]
+            seen.add(k)
+        if rows[k][0] != x:
+            rows[k][1] = x
+    return rows, pick_list(rows, rng)
+
+
+def pick_list(rows, rng):
+    young = rows[len(rows) // 2:]
+    return [row[0] for row in rng.sample(young, max(10, min(len(young), len(rows) // 100)))]
+
+
+def write_case(kind, n, prefix, seed=1):
+    """
+    :return: (pedigree file name, list file name, xref file name or None)
+    """
+    rng = random.Random("{}-{}-{}".format(kind, n, seed))
+    xref_lines = []
+    if kind == 'xref':
+        rows, lst = gen_xref(n, rng, xref_lines)
+    else:
+        rows, lst = globals()['gen_' + kind](n, rng)
+    ped_fn = prefix + ".csv"
+    lst_fn = prefix + ".list"
+    xref_fn = None
+    with open(ped_fn, 'w') as fp:
+        fp.writelines(",".join(row) + "\n" for row in rows)
+    with open(lst_fn, 'w') as fp:
+        fp.writelines(x + "\n" for x in lst)
+    if xref_lines:
+        xref_fn = prefix + ".xref"
+        with open(xref_fn, 'w') as fp:
+            fp.writelines(x + "\n" for x in xref_lines)
+    return ped_fn, lst_fn, xref_fn
+
+
+if __name__ == '__main__':
+    if len(sys.argv) not in (4, 5) or sys.argv[1] not in KINDS:
+        print(__doc__)
+        sys.exit(1)
+    write_case(sys.argv[1], int(sys.argv[2]), sys.argv[3], int(sys.argv[4]) if len(sys.argv) == 5 else 1)
@@ -0,0 +1,223 @@
+#!/usr/bin/env python3
+"""
+Behavioural regression test: refines the gen_bench_ped.py cases through the different paths of PedRefiner and
+compares their outputs with those of a plain run in memory.
+
+usage: regress.py [-n N] [-k KIND,KIND...] [-s SEED] [-w WORK_DIR]
+
+Paths, each at gen_max 0 and 3
+    cache       pipeline() with a cache_dir, the second run loading the cache
+    disk        disk mode, a memory budget below the pedigree's
+    parallel    load_checked() parsing the pedigree in 4 processes, then refine(); pipeline() parses in one
+    refresh     a previous output refreshed after a delta (new, corrected and deleted records), in memory and in
+                disk mode, against refine() after the same delta; gen_max 0 only
+    delta-cache the same delta applied on a cache miss, then on a cache hit, the changed IDs listed, against
+                refine() after it
+    server      /refine and /descendants of PedServer against refine() and refine(flag_r=True), the listed IDs
+                unknown to the pedigree first; such IDs must not change it
+Every output must also list parents before offspring. Exit status 1 on any difference.
+"""
+
+import os
+import sys
+import random
+import logging
+import argparse
+import tempfile
+import threading
+import urllib.request
+
+import gen_bench_ped
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "pedRefiner"))
+from pedRefiner import PedRefiner, PedServer
+
+KINDS = ('chain', 'halfsib', 'inbred', 'xref')      # the cases passing check()
+
+
+def read_lines(file_name):
+    with open(file_name, 'r') as fp:
+        return fp.read().splitlines()
+
+
+def parents_first(lines, sep=",", missing='.'):
+    """
+    :return: bool, True if the parents of each row are missing or in an earlier row
+    """
+    seen = set()
+    for line in lines:
+        idx, sire, dam = line.split(sep)[:3]
+        if sire != missing and sire not in seen or dam != missing and dam not in seen:
+            return False
+        seen.add(idx)
+    return True
+
+
+def write_delta(ped_fn, file_name, rng, n_change):
+    """
+    Records added with the parents of an existing record, so that no sex conflict nor loop is made; records
+    corrected to a missing sire; records deleted
+    """
+    rows = [line.split(",") for line in read_lines(ped_fn)]
+    with open(file_name, 'w') as fp:
+        for k, row in enumerate(rng.sample(rows, n_change)):
+            fp.write("+ NEW{} {} {}\n".format(k, row[1], row[2]))
+        for row in rng.sample(rows, n_change):
+            fp.write("+ {} . {}\n".format(row[0], row[2]))
+        for row in rng.sample(rows, n_change):
+            fp.write("- {}\n".format(row[0]))
+
+
+def run_case(kind, n, work_dir, seed):
+    """
+    :return: list of failures, "kind path what"
+    """
+    failures = []
+    ped_fn, lst_fn, xref_fn = gen_bench_ped.write_case(kind, n, os.path.join(work_dir, kind), seed)
+    cache_dir = os.path.join(work_dir, kind + ".cache")
+    os.makedirs(cache_dir, exist_ok=True)
+
+    def out_fn(name):
+        return os.path.join(work_dir, "{}.{}.csv".format(kind, name))
+
+    def pipeline(name, gen_max, pr=None, lst=lst_fn, **kwargs):
+        pr = pr or PedRefiner()
+        st = pr.pipeline(lst, ped_fn, out_fn(name), gen_max, xref_fn=xref_fn, **kwargs)
+        return read_lines(out_fn(name)) if os.path.exists(out_fn(name)) else None, st, pr
+
+    def expect(path, ok, what="output differs"):
+        if not ok:
+            failures.append("{} {} {}".format(kind, path, what))
+
+    refs = {}
+    for gen_max in (0, 3):
+        ref, _, _ = pipeline("ref{}".format(gen_max), gen_max)
+        refs[gen_max] = ref
+        expect("memory/g{}".format(gen_max), ref and parents_first(ref), "not parents first")
+
+        for i in range(2):
+            out, st, _ = pipeline("cache", gen_max, cache_dir=cache_dir)
+            expect("cache{}/g{}".format(i, gen_max), out == ref)
+        expect("cache/g{}".format(gen_max), 'load_cache' in st.stages, "cache not used")
+
+        out, _, pr = pipeline("disk", gen_max, mem_mb=1e-4)
+        expect("disk/g{}".format(gen_max), pr.disk_dir is not None, "not in disk mode")
+        expect("disk/g{}".format(gen_max), out == ref)
+
+        pr = PedRefiner()
+        pr.chunk_size = 1 << 14         # byte ranges of the parallel parser
+        ok = pr.load_checked(ped_fn, xref_fn=xref_fn, n_proc=4)
+        ok = ok and pr.refine(lst_fn, out_fn("parallel"), gen_max)
+        expect("parallel/g{}".format(gen_max), ok and read_lines(out_fn("parallel")) == ref)
+
+    delta_fn = os.path.join(work_dir, kind + ".delta")
+    write_delta(ped_fn, delta_fn, random.Random(seed), max(1, n // 1000))
+    for mem_mb in (None, 1e-4):
+        path = "refresh" if mem_mb is None else "refresh-disk"
+        full, _, _ = pipeline("full", 0, delta_fn=delta_fn, mem_mb=mem_mb)
+        out, st, _ = pipeline("refresh", 0, delta_fn=delta_fn, prev_fn=out_fn("ref0"), mem_mb=mem_mb)
+        expect(path, 'refresh' in st.stages, "not refreshed")
+        expect(path, out is not None and sorted(out) == sorted(full))
+        expect(path, out is not None and parents_first(out), "not parents first")
+
+    # the delta on a cache miss, then on a hit, the changed IDs listed: through the same xref maps
+    delta_lst_fn = os.path.join(work_dir, kind + ".delta.list")
+    with open(delta_lst_fn, 'w') as fp:
+        fp.write("\n".join(read_lines(lst_fn) + [line.split()[1] for line in read_lines(delta_fn)]) + "\n")
+    delta_cache_dir = os.path.join(work_dir, kind + ".delta.cache")
+    os.makedirs(delta_cache_dir, exist_ok=True)
+    full, _, _ = pipeline("full", 0, lst=delta_lst_fn, delta_fn=delta_fn)
+    for i in range(2):
+        out, st, _ = pipeline("delta-cache", 0, lst=delta_lst_fn, delta_fn=delta_fn, cache_dir=delta_cache_dir)
+        path = "delta-cache{}".format(i)
+        expect(path, ('load_cache' in st.stages) == (i == 1), "cache not used" if i else "cache used")
+        expect(path, out == full)
+
+    failures.extend(run_server(kind, ped_fn, lst_fn, xref_fn, refs, out_fn))
+    return failures
+
+
+def run_server(kind, ped_fn, lst_fn, xref_fn, refs, out_fn):
+    failures = []
+    server = PedServer(('127.0.0.1', 0), None, ped_fn, '.', '.', ',', ',', xref_fn, None)
+    if not server.reload(force=True):
+        return ["{} server not loaded".format(kind)]
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base = "http://127.0.0.1:{}".format(server.server_port)
+    listed = read_lines(lst_fn)
+    body = "\n".join(listed).encode('utf-8')
+    get_code = server.pr.get_code
+    unknown = ["{},.,.".format(idx) for idx in dict.fromkeys(listed) if not get_code(idx)]
+
+    def query(path, data=None):
+        with urllib.request.urlopen(base + path, data) as resp:
+            return resp.read().decode('utf-8').splitlines()
+
+    try:
+        for gen_max in (0, 3):
+            # listed IDs unknown to the pedigree come first, the rest as refine() writes them
+            known = [line for line in refs[gen_max] if get_code(line.split(",")[0])]
+            if query("/refine?gen_max={}".format(gen_max), body) != unknown + known:
+                failures.append("{} server/refine/g{} output differs".format(kind, gen_max))
+            pr = PedRefiner()
+            pr.pipeline(lst_fn, ped_fn, out_fn("desc"), gen_max, xref_fn=xref_fn, flag_r=True)
+            if query("/descendants?gen_max={}".format(gen_max), body) != read_lines(out_fn("desc")):
+                failures.append("{} server/descendants/g{} output differs".format(kind, gen_max))
+
+        n_id = len(server.pr.id_list)
+        out = query("/refine?id=JUNK1&id=JUNK2")
+        if out != ["JUNK1,.,.", "JUNK2,.,."] or len(server.pr.id_list) != n_id:
+            failures.append("{} server/unknown pedigree changed by a query".format(kind))
+        if query("/descendants?id=JUNK1") != []:
+            failures.append("{} server/unknown descendants of an unknown ID".format(kind))
+    except OSError as e:       # the handler failed, the connection closed without a response
+        failures.append("{} server query failed: {}".format(kind, e))
+    finally:
+        server.shutdown()
+        server.server_close()
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description="pedRefiner regression test")
+    parser.add_argument('-n', type=int, default=20000, help="records per case (20000)")
+    parser.add_argument('-k', default=",".join(KINDS), help="cases, comma separated ({})".format(",".join(KINDS)))
+    parser.add_argument('-s', type=int, default=1, help="random seed (1)")
+    parser.add_argument('-w', default=None, help="work directory, kept (a temporary one)")
+    args = parser.parse_args()
+
+    kinds = args.k.split(",")
+    for kind in kinds:
+        if kind not in gen_bench_ped.KINDS:
+            parser.error("unknown case {}, one of {}".format(kind, ", ".join(gen_bench_ped.KINDS)))
+    logging.disable(logging.CRITICAL)
+    tmp_dir = None
+    work_dir = args.w
+    if work_dir is None:
+        tmp_dir = tempfile.TemporaryDirectory(prefix="pedRefiner.regress.")
+        work_dir = tmp_dir.name
+    work_dir = os.path.abspath(work_dir)
+    os.makedirs(work_dir, exist_ok=True)
+    cwd = os.getcwd()
+    os.chdir(work_dir)      # xref.CorrectB and xref.CorrectL go there
+
+    failures = []
+    try:
+        for kind in kinds:
+            try:
+                fails = run_case(kind, args.n, work_dir, args.s)
+            except Exception as e:
+                fails = ["{} {}: {}".format(kind, type(e).__name__, e)]
+            print("{:8} {}".format(kind, "ok" if not fails else "FAILED"))
+            failures.extend(fails)
+    finally:
+        os.chdir(cwd)
+        if tmp_dir is not None:
+            tmp_dir.cleanup()
+    for fail in failures:
+        print("# " + fail)
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -2,7 +2,133 @@
 
 set -xue
 
+tmp=$(mktemp -d)
+trap 'rm -rf "$tmp"' EXIT
+
 python3 gen_long_ped.py > long_ped.csv
 echo "1" > list
 
-time python3 ../pedRefiner/pedRefiner.py list long_ped.csv out.long_ped.csv
+# against the output kept in out.long_ped.csv, parents before offspring
+time python3 ../pedRefiner/pedRefiner.py list long_ped.csv "$tmp/out.long_ped.csv"
+cmp out.long_ped.csv "$tmp/out.long_ped.csv"
+
+# refresh of a previous output in disk mode (memory budget below the pedigree's), with a listed ID not in it
+(cat list; echo NOT_IN_PED) > "$tmp/list"
+python3 ../pedRefiner/pedRefiner.py "$tmp/list" long_ped.csv "$tmp/prev.csv"
+python3 -c "
+import sys
+sys.path.insert(0, '../pedRefiner')
+from pedRefiner import PedRefiner
+st = PedRefiner().pipeline('$tmp/list', 'long_ped.csv', '$tmp/refresh.csv', prev_fn='$tmp/prev.csv', mem_mb=1e-4)
+sys.exit('refresh' not in st.stages)
+"
+cmp "$tmp/prev.csv" "$tmp/refresh.csv"
+
+# a birth-date column whose first date is not understood: 4 columns all the same, the date reported
+printf 'A,S,D,NA\nS,.,.,2000\nD,.,.,2001\n' > "$tmp/birth.csv"
+python3 -c "
+import sys
+sys.path.insert(0, '../pedRefiner')
+from pedRefiner import PedRefiner
+pr = PedRefiner()
+ok = pr.load_ped('$tmp/birth.csv') and pr.check() and pr.stats.counts['bad_births'] == 1
+sys.exit(not ok or pr.birth[pr.get_code('S')] != 2000)
+"
+
+# a loop P -> X -> C -> P through a sire of 51 offspring: xref.CorrectL breaks it by dropping 1 sire link, not 51
+src=$(cd ../pedRefiner && pwd)
+(cd "$tmp" && python3 -c "
+import sys
+sys.path.insert(0, '$src')
+from pedRefiner import PedRefiner
+with open('loop.csv', 'w') as fp:
+    fp.write('P,X,.\\nX,C,.\\nC,P,.\\n' + ''.join('O{},P,.\\n'.format(i) for i in range(50)))
+pr = PedRefiner()
+ok = pr.load_ped('loop.csv') and not pr.check()
+pr.load_xref_map('xref.CorrectL')
+ok = ok and pr.load_ped('loop.csv') and pr.check()
+sys.exit(not ok or pr.stats.counts['missing_sire'] != 1)     # none missing in loop.csv
+")
+
+# check(codes) after a delta keeps the sex conflicts and loops of the IDs it did not change
+(cd "$tmp" && python3 -c "
+import sys
+sys.path.insert(0, '$src')
+from pedRefiner import PedRefiner
+with open('conflict.csv', 'w') as fp:
+    fp.write('A,X,Y\\nB,Y,X\\nP,C,.\\nC,P,.\\n')
+with open('new.delta', 'w') as fp:
+    fp.write('+ N . .\\n')
+with open('del.delta', 'w') as fp:
+    fp.write('- B\\n')
+pr = PedRefiner()
+ok = pr.load_ped('conflict.csv') and not pr.check()
+counts = pr.stats.counts
+ok = ok and not pr.check(pr.apply_delta('new.delta')) and (counts['sex_conflicts'], counts['loops']) == (2, 1)
+with open('xref.CorrectB') as fp:
+    ok = ok and len(fp.readlines()) == 2
+ok = ok and not pr.check(pr.apply_delta('del.delta')) and (counts['sex_conflicts'], counts['loops']) == (0, 1)
+sys.exit(not ok)
+")
+
+# an ID renamed by apply_xref() onto one read before it: its record replaces the other, as when reloading
+printf 'B,S,.\nS,.,.\nA,S,D\n' > "$tmp/rename.csv"
+echo 'A A B' > "$tmp/rename.xref"
+(cd "$tmp" && python3 -c "
+import sys
+sys.path.insert(0, '$src')
+from pedRefiner import PedRefiner
+pr = PedRefiner()
+ok = pr.load_ped('rename.csv') and pr.apply_xref('rename.xref') is not None and pr.ped_map['B'] == ('S', 'D')
+ref = PedRefiner()
+ok = ok and ref.load_xref_map('rename.xref') and ref.load_ped('rename.csv') and dict(ref.ped_map) == dict(pr.ped_map)
+sys.exit(not ok or pr.n_rec != 2)
+")
+
+# a 3-column source after one with birth dates still takes 3 fields per line only
+printf 'S,.,.\nD,.,.\nX,S,D,2001\n' > "$tmp/three.csv"
+python3 -c "
+import sys
+sys.path.insert(0, '../pedRefiner')
+from pedRefiner import PedRefiner
+pr = PedRefiner()
+ok = pr.load_ped(['$tmp/birth.csv', '$tmp/birth.csv']) and not pr.load_ped(['$tmp/birth.csv', '$tmp/three.csv'])
+sys.exit(not ok)
+"
+
+# inbreeding coefficients against the tabular method, on a random pedigree of overlapping generations
+(cd "$tmp" && python3 -c "
+import sys, random
+sys.path.insert(0, '$src')
+from pedRefiner import PedRefiner
+rnd = random.Random(1)
+rows = [(i, rnd.randrange(max(i - 40, 0), i) if i > 5 else 0, rnd.randrange(max(i - 40, 0), i) if i > 5 else 0)
+        for i in range(1, 301)]
+with open('inbred.csv', 'w') as fp:
+    fp.writelines('{},{},{}\\n'.format(i, s or '.', d or '.') for i, s, d in rows)
+a = {}
+for i, s, d in rows:
+    for j in range(1, i):
+        a[i, j] = a[j, i] = .5 * (a.get((j, s), 0.) + a.get((j, d), 0.))
+    a[i, i] = 1. + .5 * a.get((s, d), 0.)
+pr = PedRefiner()
+pr.load_ped('inbred.csv')
+codes = [row[0] for row in pr.query_refine([str(i) for i in range(1, 301)], 0)]
+f, _ = pr.get_inbreeding(codes)
+ok = len(f) == 300 and sum(fi > 0. for fi in f) > 100
+sys.exit(not ok or max(abs(fi + 1. - a[int(pr.id_list[c]), int(pr.id_list[c])]) for c, fi in zip(codes, f)) > 1e-9)
+")
+
+# the closure of an ancestor already memoized is reused through the cache, counted as a hit
+printf 'A,.,.\nB,A,.\nC,B,.\nD,C,.\n' > "$tmp/chain.csv"
+python3 -c "
+import sys
+sys.path.insert(0, '../pedRefiner')
+from pedRefiner import PedRefiner
+pr = PedRefiner()
+ok = pr.load_ped('$tmp/chain.csv') and pr.get_ancestors(['B']) == ['A'] and pr.get_ancestors(['D']) == ['A', 'B', 'C']
+sys.exit(not ok or pr.memo.hits != 1)
+"
+
+# outputs of the cache, disk, parallel, refresh and server paths against a plain run, on the bench cases
+python3 regress.py